@@ -1,22 +1,23 @@
 #!/usr/bin/env bash
 
 nettype=("ODDEVEN")
-limit=256
-p=$((2 ** 13))
+logp=13
+p=$((2 ** logp))
+# Depth of the network, longer ranges would all be the full network.
+limit=$((logp * (logp + 1) / 2))
 for alg in "${nettype[@]}"; do
-    for ((i = 2; i <= limit; i++)); do
-        param="generate $alg $p stagewise 1 - ""\
-include_stages_range 0 $i - ""\
-replace_ff REGISTER_DSP --entity_ff=48 --limit=6840 - ""\
-write - "
-        echo "python netgen.py $param"
-        python netgen.py $param
-    done
+    param="generate $alg $p --SW=1 --stagewise - ""\
+sweep --min_end=2 --max_end=$limit ""\
+--entity=REGISTER_DSP --entity_ff=[48] --limits=[6840]"
+    echo "python netgen.py $param"
+    python netgen.py $param
 done
 
 for alg in "${nettype[@]}"; do
-    for ((i = 2; i <= limit; i++)); do
+    for ((i = 2; i < limit; i++)); do
         echo "make BOARD=vcu118 SORTER=\"build/${alg}_${p}X${p}_STAGEWISE_S${i}_FULL\""
-        make BOARD=vcu118 SORTER="build/${alg}_${p}X${p}_STAGEWISE_STAGE${i}_FULL"
+        make BOARD=vcu118 SORTER="build/${alg}_${p}X${p}_STAGEWISE_S${i}_FULL"
     done
+    echo "make BOARD=vcu118 SORTER=\"build/${alg}_${p}X${p}_STAGEWISE_FULL\""
+    make BOARD=vcu118 SORTER="build/${alg}_${p}X${p}_STAGEWISE_FULL"
 done
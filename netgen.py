@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 from pathlib import Path
+import itertools
 import numpy as np
 import math
 import fire
@@ -8,34 +9,232 @@ import time
 
 from scripts import vhdl
 import scripts.network_generators as generators
-from scripts.reporter import Reporter, Report
+from scripts.reporter import Reporter, Report, ReportStore
 from scripts.template_processor import (
     VHDLTemplateProcessor,
     VHDLTemplateProcessorStagewise,
 )
-from scripts.resource_allocator import BlockAllocator, StageAllocator, is_ff
-from scripts.plotter import PlotWrapper
+from scripts.resource_allocator import (
+    AllocationCache,
+    BlockAllocator,
+    ChainAllocator,
+    ClusterAllocator,
+    ReplacementPlanner,
+    Resource,
+    StageAllocator,
+    is_ff,
+)
 
 
-def get_sources(path=Path()):
+def get_sources(path=Path(), cache: vhdl.ParseCache = None):
     sources = dict()
     for source in path.glob("./**/*.vhd"):
-        entity = vhdl.parseVHDLEntity(source)
+        if cache:
+            entity = cache.parse(source, vhdl.parseVHDLEntity)
+        else:
+            entity = vhdl.parseVHDLEntity(source)
         if entity:
             sources[entity.name] = entity
     return sources
 
 
-def get_templates(path=Path()):
+def get_templates(path=Path(), cache: vhdl.ParseCache = None):
     templates = dict()
     for source in path.glob("./**/*.vhd"):
-        template = vhdl.parseVHDLTemplate(source)
+        if cache:
+            template = cache.parse(source, vhdl.parseVHDLTemplate)
+        else:
+            template = vhdl.parseVHDLTemplate(source)
         if template:
             template.name = source.name
             templates[template.name] = template
     return templates
 
 
+def get_output_set(output_config: str, num_outputs: int, N: int) -> set[int]:
+    """Returns indices of the outputs of a "max", "min" or "median" output
+    configuration with num_outputs outputs."""
+    if output_config.lower() == "max":
+        return set(range(0, num_outputs))
+    elif output_config.lower() == "min":
+        return set(range(N - num_outputs, N))
+    lower_bound = N // 2 - num_outputs // 2
+    upper_bound = N // 2 + (num_outputs + 1) // 2
+    return set(range(lower_bound, upper_bound))
+
+
+def network_name(
+    network: generators.Network, stagewise: bool, stage_set: set[int], beg: int = 0
+):
+    """Returns the name of the network used for its build directory. A first
+    stage beg > 0 of a range of stages is added as _B*beg*."""
+    name = network.algorithm
+    name += "_" + str(network.get_N())
+    name += "X" + str(len(network.output_set))
+    if stagewise:
+        name += "_STAGEWISE"
+
+    logp = int(math.ceil((math.log2(network.get_N()))))
+    if network.get_depth() < logp * (logp + 1) // 2:
+        if len(stage_set) == 1:
+            s = stage_set.copy()
+            elem = s.pop()
+            name += "_STAGE" + str(elem)
+        else:
+            if beg > 0:
+                name += "_B" + str(beg)
+            name += "_S" + str(len(stage_set))
+    if network.output_config:
+        name += "_" + network.output_config.upper()
+    return name
+
+
+# Allocators of networks which are not stagewise by name.
+ALLOCATORS = {"block": BlockAllocator, "cluster": ClusterAllocator}
+
+
+def allocate_ff(
+    network: generators.Network,
+    entity,
+    limit: int,
+    entity_ff: int,
+    stagewise: bool,
+    locality: float = 0.0,
+    allocator: str = "block",
+    min_chain: int = 8,
+    width: int = 1,
+    cache: AllocationCache = None,
+):
+    """Replaces network FF with the entity given, see Interface.replace_ff.
+    With a cache given, identical allocations are loaded from it."""
+    if allocator == "chain":
+        if stagewise:
+            raise ValueError("The chain allocator does not support stagewise networks.")
+        ralloc = ChainAllocator(min_chain, width)
+    elif allocator not in ALLOCATORS:
+        raise ValueError(
+            "Unknown allocator '{}', expected one of {}.".format(
+                allocator, list(ALLOCATORS) + ["chain"]
+            )
+        )
+    else:
+        ralloc = ALLOCATORS[allocator](locality)
+    if stagewise:
+        ralloc = StageAllocator()
+    if cache:
+        return cache.reallocate_ff(ralloc, network, entity, limit, entity_ff)
+    return ralloc.reallocate_ff(
+        network,
+        entity=entity,
+        max_entities=limit,
+        ff_per_entity=entity_ff,
+    )
+
+
+def write_network(
+    network: generators.Network,
+    path: Path,
+    name: str,
+    entities: dict,
+    templates: dict,
+    stagewise: bool,
+    cs: str,
+    W: int,
+    ff_replacements: list,
+):
+    """Writes "Network.vhd", "Sorter.vhd" and "Test_Sorter.vhd" of the network
+    to path, see Interface.write."""
+    # Templates: Network.vhd, Sorter.vhd, Test_Sorter.vhd
+    template_names = ["Sorter.vhd", "Test_Sorter.vhd"]
+    path.mkdir(parents=True, exist_ok=True)
+    template_processor = None
+    if stagewise:
+        template_processor = VHDLTemplateProcessorStagewise()
+    else:
+        template_processor = VHDLTemplateProcessor()
+
+    cs_entities = {
+        "CS": entities[cs],
+        "Signal_Distributor": entities["SIGNAL_DISTRIBUTOR"],
+        "Stage": entities["Stage"],
+    }
+    kwargs = {"W": W, "ff_replacements": ff_replacements}
+    template_processor.process_network_template(
+        path / "Network.vhd",
+        network,
+        name,
+        templates["Network.vhd"],
+        cs_entities,
+        **kwargs,
+    )
+    for temp in template_names:
+        template_processor.process_template(
+            path / temp,
+            network,
+            name,
+            templates[temp],
+            **kwargs,
+        )
+    return template_names
+
+
+# Sources, templates and allocation cache of the sweep worker processes.
+sweep_entities = dict()
+sweep_templates = dict()
+sweep_cache = None
+
+
+def init_sweep_worker(entities: dict, templates: dict):
+    global sweep_entities, sweep_templates, sweep_cache
+    sweep_entities = entities
+    sweep_templates = templates
+    sweep_cache = AllocationCache()
+
+
+def write_sweep_variant(
+    network: generators.Network,
+    name: str,
+    build_name: str,
+    stagewise: bool,
+    replacement: tuple,
+    cs: str,
+    W: int,
+) -> Report:
+    """Allocates FF replacements of one sweep variant, writes it to
+    build/build_name/ and returns its report. The report's cache_hit tells
+    whether the allocation was loaded from the allocation cache, None if FF
+    are not replaced."""
+    report = Report(network)
+    report.cache_hit = None
+    ff_replacements = []
+    if replacement:
+        entity, limit, entity_ff = replacement
+        ffrepl = allocate_ff(
+            network,
+            sweep_entities[entity],
+            limit,
+            entity_ff,
+            stagewise,
+            cache=sweep_cache,
+        )
+        report.cache_hit = sweep_cache.last_hit
+        report.evaluate_ffreplacement(ffrepl)
+        ff_replacements.append(ffrepl)
+    write_network(
+        network,
+        Path("build/{}/".format(build_name)),
+        name,
+        sweep_entities,
+        sweep_templates,
+        stagewise,
+        cs,
+        W,
+        ff_replacements,
+    )
+    report.content["name"] = build_name
+    return report
+
+
 def print_timestamp(title: str):
     time_str = "[%b %d %H:%M:%S]: "
     print(time.strftime(time_str) + title, end="")
@@ -44,17 +243,23 @@ def print_timestamp(title: str):
 class Interface:
     def __init__(self):
         self.__start_time = time.perf_counter_ns()
+        # Parsed files are cached in build/.cache/, only new or changed files
+        # are parsed.
+        cache = vhdl.ParseCache()
         self.__entities = dict()
         print_timestamp("Parsing sources...")
-        self.__entities = get_sources(Path("src/"))
+        self.__entities = get_sources(Path("src/"), cache)
         print(" done.")
         self.__templates = dict()
         print_timestamp("Parsing templates...")
-        self.__templates = get_templates(Path("templates/"))
+        self.__templates = get_templates(Path("templates/"), cache)
         print(" done.")
+        cache.save()
         self.__generator = None
         self.__network = None
         self.__ffreplacements = []
+        # Allocations are cached in build/.cache/allocations/.
+        self.__allocation_cache = AllocationCache()
         self.__reporter = Reporter()
         self.__stagewise = False
         self.__stage_set: set[int] = []
@@ -114,7 +319,7 @@ class Interface:
 
         else:
             print("components:")
-            for entity in get_sources(Path("src/")).values():
+            for entity in self.__entities.values():
                 print("\t" + entity.name)
             print("templates:")
             for template in Path("templates/").glob("**/*.vhd"):
@@ -221,19 +426,9 @@ class Interface:
                 ),
             )
             N = self.__network.get_N()
-            if output_config.lower() == "max":
-                self.__generator.prune(self.__network, set(range(0, num_outputs)))
-                self.__network.output_config = "max"
-            elif output_config.lower() == "min":
-                self.__generator.prune(self.__network, set(range(N - num_outputs, N)))
-                self.__network.output_config = "min"
-            elif output_config.lower() == "median":
-                lower_bound = N // 2 - num_outputs // 2
-                upper_bound = N // 2 + (num_outputs + 1) // 2
-                self.__generator.prune(
-                    self.__network, set(range(lower_bound, upper_bound))
-                )
-                self.__network.output_config = "median"
+            output_set = get_output_set(output_config, num_outputs, N)
+            self.__network = self.__generator.prune(self.__network, output_set)
+            self.__network.output_config = output_config.lower()
             print(" done.")
             self.__reporter.report_network(self.__network)
         return self
@@ -254,7 +449,7 @@ class Interface:
         print_timestamp(
             "Pruning Network outputs...",
         )
-        self.__generator.prune(self.__network, set(output_set))
+        self.__network = self.__generator.prune(self.__network, set(output_set))
         self.__network.output_config = name
         print(" done.")
         self.__reporter.report_network(self.__network)
@@ -271,22 +466,33 @@ class Interface:
             i for i in stage_indices if i >= 0 and i < self.__network.get_depth()
         ]
         self.__stage_set = self.__stage_set.difference(stage_indices)
-        self.__generator.exclude_stages(self.__network, stage_indices)
+        self.__network = self.__generator.exclude_stages(self.__network, stage_indices)
         return self
 
     def include_stages(self, stage_indices: list[int]):
         """Include only stages with indices given by stage_indices list."""
         self.__stage_set = self.__stage_set.intersection(stage_indices)
-        self.__generator.include_stages(self.__network, stage_indices)
+        self.__network = self.__generator.include_stages(self.__network, stage_indices)
         return self
 
     def include_stages_range(self, beg: int, end: int):
         """Include only stages to indices given by range between beg and end."""
         self.__stage_set = self.__stage_set.intersection(range(beg, end))
-        self.__generator.include_stages(self.__network, range(beg, end))
+        self.__network = self.__generator.include_stages(
+            self.__network, range(beg, end)
+        )
         return self
 
-    def replace_ff(self, entity: str, limit=1500, entity_ff=48):
+    def replace_ff(
+        self,
+        entity: str,
+        limit=1500,
+        entity_ff=48,
+        locality=0.0,
+        allocator="block",
+        min_chain=8,
+        width=1,
+    ):
         """Replace network FF with resource given by parameters. Algorithm used
         attempts to keep a measure of locality at the cost of efficiency in the
         replacement FF capacity.
@@ -302,24 +508,129 @@ class Interface:
             entity_ff: int
                 Maximum number of FF to be replaced with one instantce of the
                 replacement. Depends on the target device.
+            locality: float
+                If more groups of FF are found than replacements allowed, the
+                groups replacing the most FF are kept. Each unit of the
+                bounding box diagonal of a group is weighted as this many FF
+                less. Only used if not stagewise.
+            allocator: str
+                Allocator grouping the FF if not stagewise. 'block' divides the
+                network into rectangles, 'cluster' refines these groups with
+                capacity-constrained k-means for more compact groups at a
+                higher allocation time. 'chain' replaces each chain of FF in
+                the data path with a delay line entity like SHIFT_REGISTER or
+                SHIFT_REGISTER_BRAM instead. Stagewise networks are allocated
+                stage by stage.
+            min_chain: int
+                Minimum length of the chains replaced by the 'chain'
+                allocator, shorter chains remain in the fabric.
+            width: int
+                Bits per delay line of the 'chain' allocator, 1 for
+                SHIFT_REGISTER and up to 72 for SHIFT_REGISTER_BRAM. A delay
+                line delays entity_ff // width stages at most, longer chains
+                are split.
         """
+        if allocator == "chain" and self.__stagewise:
+            print("Error: the chain allocator does not support stagewise networks.")
+            return self
+        if allocator != "chain" and allocator not in ALLOCATORS:
+            print("Error: allocator options are", ", ".join([*ALLOCATORS, "chain"]))
+            return self
         print_timestamp(
             "Replacing FF with {} resource...".format(entity),
         )
-        entity_obj = self.__entities[entity]
-        ralloc = BlockAllocator()
-        ffrepl = []
-        if self.__stagewise:
-            ralloc = StageAllocator()
-        ffrepl = ralloc.reallocate_ff(
+        ffrepl = allocate_ff(
             self.__network,
-            entity=entity_obj,
-            max_entities=limit,
-            ff_per_entity=entity_ff,
+            self.__entities[entity],
+            limit,
+            entity_ff,
+            self.__stagewise,
+            locality,
+            allocator,
+            min_chain,
+            width,
+            self.__allocation_cache,
         )
         self.__reporter.report_ff_replacement(ffrepl)
         self.__ffreplacements.append(ffrepl)
+        if self.__allocation_cache.last_hit:
+            print(" done (cached).")
+        else:
+            print(" done.")
+        return self
+
+    def plan_ff(
+        self,
+        dsp: int = 1500,
+        bram: int = 0,
+        srl: int = 0,
+        dsp_ff: int = 48,
+        bram_width: int = 72,
+        bram_depth: int = 512,
+        bram_min_depth: int = 8,
+        srl_depth: int = 32,
+        srl_min_depth: int = 2,
+        locality: float = 0.0,
+        allocator: str = "block",
+    ):
+        """Replace network FF with several resources in one pass. Chains of
+        at least bram_min_depth FF of the stream layer are replaced with
+        SHIFT_REGISTER_BRAM delay lines first, the remaining FF with
+        REGISTER_DSP as by replace_ff, and chains still left of at least
+        srl_min_depth FF with SHIFT_REGISTER delay lines of one bit each.
+        FF left over remain in the fabric. Only networks which are not
+        stagewise are supported.
+
+        Parameters:
+            dsp, bram, srl: int
+                Maximum number of DSPs, BRAMs and LUTs used as shift register
+                to use. A budget of 0 leaves the resource unused.
+            dsp_ff: int
+                Maximum number of FF replaced by one DSP.
+            bram_width, bram_depth: int
+                Maximum number of bits and stages of a BRAM delay line.
+            bram_min_depth: int
+                Minimum number of stages of a BRAM delay line.
+            srl_depth: int
+                Maximum number of stages of a LUT shift register.
+            srl_min_depth: int
+                Minimum number of stages of a LUT shift register.
+            locality, allocator:
+                Allocation of the DSPs, see replace_ff.
+        """
+        if self.__stagewise:
+            print("Error: plan_ff does not support stagewise networks.")
+            return self
+        if allocator not in ALLOCATORS:
+            print("Error: allocator options are", ", ".join(ALLOCATORS))
+            return self
+        print_timestamp("Planning FF replacements...")
+        resources = [
+            Resource(
+                self.__entities["SHIFT_REGISTER_BRAM"],
+                bram,
+                bram_depth,
+                bram_width,
+                max(bram_min_depth, 2),
+            ),
+            Resource(self.__entities["REGISTER_DSP"], dsp, dsp_ff),
+            Resource(
+                self.__entities["SHIFT_REGISTER"], srl, srl_depth, 1, srl_min_depth
+            ),
+        ]
+        planner = ReplacementPlanner(ALLOCATORS[allocator](locality))
+        ffrepls = planner.plan(self.__network, resources)
+        self.__reporter.report_ff_replacements(ffrepls)
+        self.__ffreplacements += ffrepls
         print(" done.")
+        for ffrepl in ffrepls:
+            print(
+                "\t{}: {} instances replacing {} FF".format(
+                    ffrepl.entity.name,
+                    len(ffrepl.groups),
+                    int(ffrepl.groups.num_ff().sum()),
+                )
+            )
         return self
 
     def write(
@@ -342,72 +653,232 @@ class Interface:
             W:
                 Width or length of the words to be sorted.
         """
-        # Templates: Network.vhd, Sorter.vhd, Test_Sorter.vhd
-        template_names = ["Sorter.vhd", "Test_Sorter.vhd"]
         print_timestamp(
             "Writing templates ...",
         )
-        cs_entity = self.__entities[cs]
+        self.__write_network(self.__network, path, cs, W, self.__ffreplacements)
+        print_timestamp("Writing reports ...")
+        self.__reporter.commit_report()
+        path = "build/report.db"
+        self.__reporter.write_report(path)
+        print(" done.")
+        print("Added data to build/report.db.")
+        return self
+
+    def write_variants(
+        self,
+        output_configs: list[str] = ["max", "min", "median"],
+        num_outputs: list[int] = [1],
+        output_sets: list[list[int]] = [],
+        cs: str = "SWCS",
+        W: int = 8,
+    ):
+        """Write several reshaped variants of the network in one go. Every
+        variant is pruned from the network generated once, sharing its arrays
+        and leaving it unchanged. Each variant is written to
+        'build/*NetworkName*/' as by write and reported.
+
+        Parameters:
+            output_configs: list[str]
+                Output configurations to produce. Valid options are "max",
+                "min" or "median".
+            num_outputs: list[int]
+                Numbers of outputs to produce for each output configuration.
+            output_sets: list[list[int]]
+                Additional sets of output indices, named 'mixed', 'mixed1', ...
+            cs:
+                Name of the CS element instantiated in the code.
+            W:
+                Width or length of the words to be sorted.
+        """
+        N = self.__network.get_N()
+        variants = []
+        for output_config in output_configs:
+            if output_config.lower() not in ["max", "min", "median"]:
+                print("Error: output_config options are max, min, median")
+                continue
+            for num in num_outputs:
+                output_set = get_output_set(output_config, num, N)
+                variants.append((output_config.lower(), output_set))
+        for i, output_set in enumerate(output_sets):
+            name = "mixed" + (str(i) if i else "")
+            variants.append((name, set(output_set)))
+
+        for output_config, output_set in variants:
+            print_timestamp(
+                "Writing {} with {} outputs...".format(output_config, len(output_set))
+            )
+            network = self.__generator.prune(self.__network, output_set)
+            network.output_config = output_config
+            self.__write_network(network, "", cs, W, [])
+            self.__reporter.commit(Report(network))
+        print_timestamp("Writing reports ...")
+        self.__reporter.write_report("build/report.db")
+        print(" done.")
+        print("Added data to build/report.db.")
+        return self
+
+    def sweep(
+        self,
+        min_end: int = 0,
+        max_end: int = 0,
+        beg: int = 0,
+        stage_ranges: list[list[int]] = [],
+        entity: str = "",
+        limits: list[int] = [1500],
+        entity_ff: list[int] = [48],
+        cs: str = "SWCS",
+        W: int = 8,
+        processes: int = 0,
+    ):
+        """Write variants of the network for several stage ranges and FF
+        replacements. The network is generated once, each variant is derived
+        from it, allocated and written to 'build/*NetworkName*/' by a pool of
+        processes. Reports of all variants are added to build/report.db at
+        the end, named after the build directory of the variant. Ranges are
+        clipped to the depth of the network and ranges starting at a stage
+        beg > 0 are named with _B*beg*, variants with the same name are
+        written once. With more than one FF replacement, the directories are
+        suffixed by _ENTITY_L*limit*_F*entity_ff*. Allocations are cached in
+        build/.cache/allocations/, the share loaded from the cache is printed
+        at the end.
+
+        Parameters:
+            min_end, max_end: int
+                Include stages from beg to each end in min_end to max_end
+                like include_stages_range.
+            beg: int
+                First stage of the ranges given by min_end and max_end.
+            stage_ranges: list[list[int]]
+                Additional [beg, end] stage ranges.
+            entity: str
+                Name of the entity to use as a FF replacement. If empty, FF
+                are not replaced.
+            limits: list[int]
+                Maximum numbers of replacements to use.
+            entity_ff: list[int]
+                Maximum numbers of FF replaced with one instance of the entity.
+                Each combination of limit and entity_ff is a variant.
+            cs:
+                Name of the CS element instantiated in the code.
+            W:
+                Width or length of the words to be sorted.
+            processes: int
+                Number of worker processes. Defaults to the number of CPUs.
+        """
+        ranges = [(beg, end) for end in range(min_end, max_end + 1)]
+        ranges += [tuple(r) for r in stage_ranges]
+        if not ranges:
+            ranges = [(0, self.__network.get_depth())]
+        replacements = [None]
+        if entity:
+            replacements = [
+                (entity, limit, ff)
+                for limit, ff in itertools.product(limits, entity_ff)
+            ]
+
+        depth = self.__network.get_depth()
+        tasks = {}
+        for (range_beg, range_end), replacement in itertools.product(
+            ranges, replacements
+        ):
+            range_beg, range_end = min(range_beg, depth), min(range_end, depth)
+            stage_set = self.__stage_set.intersection(range(range_beg, range_end))
+            network = self.__generator.include_stages(
+                self.__network, range(range_beg, range_end)
+            )
+            name = network_name(network, self.__stagewise, stage_set, range_beg)
+            build_name = name
+            if len(replacements) > 1:
+                build_name += "_{}_L{}_F{}".format(*replacement)
+            # Workers writing the same build directory would race.
+            if build_name not in tasks:
+                tasks[build_name] = (
+                    network,
+                    name,
+                    build_name,
+                    self.__stagewise,
+                    replacement,
+                    cs,
+                    W,
+                )
+
+        # multiprocessing is only loaded by commands using a process pool.
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+
+        print_timestamp("Writing {} variants...\n".format(len(tasks)))
+        with ProcessPoolExecutor(
+            max_workers=processes or None,
+            initializer=init_sweep_worker,
+            initargs=(self.__entities, self.__templates),
+        ) as pool:
+            futures = [
+                pool.submit(write_sweep_variant, *task) for task in tasks.values()
+            ]
+            cache_hits = []
+            for future in as_completed(futures):
+                report = future.result()
+                if report.cache_hit is not None:
+                    cache_hits.append(report.cache_hit)
+                self.__reporter.commit(report)
+                print_timestamp("Wrote build/{}/\n".format(report.content["name"]))
+        if cache_hits:
+            print_timestamp(
+                "Allocation cache: {} of {} allocations loaded ({:.0%}).\n".format(
+                    sum(cache_hits), len(cache_hits), sum(cache_hits) / len(cache_hits)
+                )
+            )
+
+        print_timestamp("Writing reports ...")
+        self.__reporter.write_report("build/report.db")
+        print(" done.")
+        print("Added data to build/report.db.")
+        return self
+
+    def __write_network(
+        self,
+        network: generators.Network,
+        path: str,
+        cs: str,
+        W: int,
+        ff_replacements: list,
+    ):
+        name = network_name(network, self.__stagewise, self.__stage_set)
         if not path:
-            name = self.__network.algorithm
-            name += "_" + str(self.__network.get_N())
-            name += "X" + str(len(self.__network.output_set))
-            if self.__stagewise:
-                name += "_STAGEWISE"
-
-            logp = int(math.ceil((math.log2(self.__network.get_N()))))
-            if self.__network.get_depth() < logp * (logp + 1) // 2:
-                if len(self.__stage_set) == 1:
-                    s = self.__stage_set.copy()
-                    elem = s.pop()
-                    name += "_STAGE" + str(elem)
-                else:
-                    name += "_S" + str(len(self.__stage_set))
-            if self.__network.output_config:
-                name += "_" + self.__network.output_config.upper()
             path = "build/{}/".format(name)
         path_obj = Path(path)
-        path_obj.mkdir(parents=True, exist_ok=True)
-        template_processor = None
-        if self.__stagewise:
-            template_processor = VHDLTemplateProcessorStagewise()
-        else:
-            template_processor = VHDLTemplateProcessor()
-
-        entities = {
-            "CS": cs_entity,
-            "Signal_Distributor": self.__entities["SIGNAL_DISTRIBUTOR"],
-            "Stage": self.__entities["Stage"],
-        }
-        kwargs = {"W": W, "ff_replacements": self.__ffreplacements}
-        template_processor.process_network_template(
-            path_obj / "Network.vhd",
-            self.__network,
+        template_names = write_network(
+            network,
+            path_obj,
             name,
-            self.__templates["Network.vhd"],
-            entities,
-            **kwargs,
+            self.__entities,
+            self.__templates,
+            self.__stagewise,
+            cs,
+            W,
+            ff_replacements,
         )
-        for temp in template_names:
-            template_processor.process_template(
-                path_obj / temp,
-                self.__network,
-                name,
-                self.__templates[temp],
-                **kwargs,
-            )
         print(" done.")
         print(
             "Wrote Network.vhd, "
             + ", ".join(template_names)
             + " to {}".format(str(path_obj))
         )
-        print_timestamp("Writing reports ...")
-        self.__reporter.commit_report()
-        path = "build/report.csv"
-        self.__reporter.write_report(path)
+
+    def export_report(self, path: str = "build/report.csv"):
+        """Export all reports of build/report.db to a table for external
+        tools.
+
+        Parameters:
+            path: str
+                File to write. Parquet is written if the path ends with
+                ".parquet", CSV otherwise. Histograms are written to
+                *stem*_histograms with the same suffix.
+        """
+        print_timestamp("Exporting reports...")
+        with ReportStore("build/report.db") as store:
+            store.export(path)
         print(" done.")
-        print("Added data to build/report.csv.")
         return self
 
     def report_net(self):
@@ -486,6 +957,10 @@ class Interface:
             print(line)
 
     def plot(self):
+        # The plotter loads pandas and matplotlib, which most commands don't
+        # need.
+        from scripts.plotter import PlotWrapper
+
         return PlotWrapper()
 
 
@@ -0,0 +1,1128 @@
+#!/usr/bin/env python3
+
+"""Benchmarks of the network generation and optimization scripts.
+Usage:
+
+> python -m scripts.benchmarks oddeven --min_exp=4 --max_exp=16
+Times the construction of Odd-Even networks with N=2**4 to N=2**16 inputs
+and compares the result against the element-wise reference implementation.
+
+> python -m scripts.benchmarks bitonic --min_exp=4 --max_exp=14
+Same for Bitonic networks and the recursive reference implementation.
+
+> python -m scripts.benchmarks prune --min_exp=4 --max_exp=13
+Times pruning Odd-Even networks to random output sets against pruning a
+copy of the network in place, and compares the results.
+
+> python -m scripts.benchmarks derive --min_exp=4 --max_exp=12
+Times deriving networks by selections of stages and inputs, given as
+slices, ranges and index lists, and compares them against an element-wise
+reference.
+
+> python -m scripts.benchmarks report --min_exp=4 --max_exp=13
+Times the evaluation of network reports and compares the FF-chain histogram
+against the element-wise reference.
+
+> python -m scripts.benchmarks startup --budget_ms=400
+Measures the time to import netgen.py using python -X importtime and lists
+the slowest imports. Fails if the import takes longer than the budget or
+loads a module which only plotting and reporting should need.
+
+> python -m scripts.benchmarks replace_ff --min_exp=10 --max_exp=14
+Times the division of Odd-Even networks into blocks by the BlockAllocator
+against summing each block element-wise and the full allocation of FF to
+groups of 48 FF, e.g. REGISTER_DSP.
+
+> python -m scripts.benchmarks fill_groups --exp=12 --SW=[1,8,16,32]
+Times filling groups of 48 FF with all FF of an Odd-Even network against
+the element-wise filling formerly used by the allocators.
+
+> python -m scripts.benchmarks stage_ff --min_exp=10 --max_exp=13
+Times the stagewise allocation of Odd-Even networks to groups of 48 FF
+against filling the groups stage by stage.
+
+> python -m scripts.benchmarks cluster_ff --min_exp=8 --max_exp=12
+Compares replaced FF and bounding box diagonals of the groups of the
+ClusterAllocator against the BlockAllocator.
+
+> python -m scripts.benchmarks plan_ff --min_exp=8 --max_exp=12
+Compares the FF replaced by BRAM and SRL delay lines together with DSPs
+against replacing FF with DSPs only.
+
+> python -m scripts.benchmarks chain_ff --min_exp=8 --max_exp=13
+Compares the number of SRL and BRAM delay lines replacing the long FF
+chains of Odd-Even networks against the number of groups of 48 FF.
+
+> python -m scripts.benchmarks allocation_cache --min_exp=10 --max_exp=13
+Times the allocation of FF to groups of 48 FF against loading the same
+allocation from the allocation cache.
+
+> python -m scripts.benchmarks map_signal --min_exp=6 --max_exp=13
+Times mapping the START and ENABLE signals of every CS to their nearest
+source against the outward scan formerly used by the template processor.
+
+"""
+import subprocess
+import sys
+import tempfile
+import time
+from math import ceil, inf
+from pathlib import Path
+import fire
+import numpy as np
+
+import scripts.network_generators as generators
+from scripts.reporter import Report
+from scripts.resource_allocator import (
+    AllocationCache,
+    BlockAllocator,
+    ChainAllocator,
+    ClusterAllocator,
+    FFAssignment,
+    FFGroups,
+    ReplacementPlanner,
+    Resource,
+    StageAllocator,
+    fill_groups,
+)
+from scripts.template_processor import VHDLTemplateProcessor
+from scripts.vhdl import parseVHDLEntity
+
+
+def time_call(func, *args, repeat: int = 1, **kwargs):
+    """Calls func repeat times and returns the result of the last call and the
+    best wall clock time in seconds."""
+    best = float("inf")
+    result = None
+    for i in range(max(repeat, 1)):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def print_table(header: list[str], rows: list[list]):
+    """Prints rows as a table with right aligned columns."""
+    widths = [len(h) for h in header]
+    rows = [[str(c) for c in row] for row in rows]
+    for row in rows:
+        widths = [max(w, len(c)) for w, c in zip(widths, row)]
+    print(" ".join(h.rjust(w) for h, w in zip(header, widths)))
+    for row in rows:
+        print(" ".join(c.rjust(w) for c, w in zip(row, widths)))
+
+
+# Modules which must not be loaded on startup of netgen.py.
+LAZY_MODULES = ["pandas", "matplotlib", "multiprocessing", "regex"]
+
+
+def parse_importtime(output: str) -> dict[str, tuple[int, int]]:
+    """Parses the output of python -X importtime into the self and cumulative
+    import time of each module in microseconds."""
+    times = dict()
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, module = line[len("import time:") :].split("|")
+        times[module.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def reference_ff_hist(network: generators.Network) -> tuple[int, dict[int, int]]:
+    """Element-wise computation of the number of FF and the histogram of
+    FF-chain lengths formerly used by Report."""
+    depth = network.get_depth()
+    N = network.get_N()
+    num_ff = 0
+    ff_hist = [0 for i in range(depth)]
+    stream_layer = network.ff_layers[0]
+    for j in range(N):
+        i = 0
+        while i < depth:
+            if stream_layer[i][j]:
+                bypass_beg = i
+                bypass_end = i
+                while bypass_end < depth and stream_layer[bypass_end][j]:
+                    bypass_end += 1
+                bypass_end = bypass_end - 1
+                num_ff += bypass_end - bypass_beg + 1
+                ff_hist[bypass_end - bypass_beg] += 1
+                i = bypass_end
+            i += 1
+    return num_ff, {i + 1: n for i, n in enumerate(ff_hist) if n}
+
+
+def reference_fill_groups(
+    groups: list[list[FFAssignment]],
+    grp_i: int,
+    target_ff: list[int],
+    points: tuple[np.ndarray, np.ndarray, np.ndarray],
+    ff_at_points: np.ndarray,
+) -> int:
+    """Element-wise filling of groups formerly used by the allocators, which
+    sums up the FF of the current group for every point added."""
+    for point, ff_at_point in zip(zip(*(c.tolist() for c in points)), ff_at_points):
+        ff_start = 0
+        ff_end = 0
+        while ff_end < 1:
+            cur_group_ff = sum([a.ff_range[1] - a.ff_range[0] for a in groups[grp_i]])
+            ff_end_prev = ff_end
+            ff_end = min(int(ff_at_point), target_ff[grp_i] - cur_group_ff)
+            groups[grp_i].append(FFAssignment(point, (ff_start, ff_end)))
+            ff_start = ff_end_prev
+            if cur_group_ff + ff_end >= target_ff[grp_i]:
+                grp_i += 1
+    return grp_i
+
+
+def reference_stage_source(
+    network: generators.Network, z: int, point: tuple[int, int]
+) -> tuple[int, int, int]:
+    """Outward scan for the nearest source in the same stage formerly used
+    by the template processor for PER_STAGE signals."""
+    x, y = point
+    if network.ff_layers[z, y, x]:
+        return (x, y, z)
+    dist = 1
+    N = network.get_N()
+    while x - dist >= 0 or x + dist < N:
+        if x + dist < N and network.ff_layers[z, y, x + dist]:
+            return (x + dist, y, z)
+        if x - dist >= 0 and network.ff_layers[z, y, x - dist]:
+            return (x - dist, y, z)
+        dist += 1
+    return (-1, -1, -1)
+
+
+def networks_equal(a: generators.Network, b: generators.Network) -> bool:
+    """Checks whether two networks have identical permutation and FF layers."""
+    return (
+        a.pmatrix.dtype == b.pmatrix.dtype
+        and np.array_equal(a.pmatrix, b.pmatrix)
+        and np.array_equal(a.ff_layers, b.ff_layers)
+    )
+
+
+def reference_derive(
+    network: generators.Network, stages: list[int], columns: list[int]
+) -> generators.Network:
+    """Element-wise selection of stages and inputs of a network as done by
+    Network.derive."""
+    renumber = dict((x, i) for i, x in enumerate(columns))
+    derived = network.copy()
+    pmatrix = np.zeros((len(stages), len(columns)), dtype=network.pmatrix.dtype)
+    for y, stage in enumerate(stages):
+        for i, x in enumerate(columns):
+            partner = network.pmatrix[stage, x]
+            if abs(partner) in renumber:
+                pmatrix[y, i] = renumber[abs(partner)]
+                if partner < 0:
+                    pmatrix[y, i] = -pmatrix[y, i]
+            else:
+                pmatrix[y, i] = i
+    derived.pmatrix = pmatrix
+    derived.ff_layers = generators.FFLayers.from_array(
+        network.ff_layers.to_array()[:, stages][:, :, columns]
+    )
+    derived.output_set = set(renumber[x] for x in network.output_set if x in renumber)
+    return derived
+
+
+def reference_prune(
+    network: generators.Network, output_set: set[int]
+) -> generators.Network:
+    """Prunes a copy of the network stage by stage in place, removing stages
+    without CS elements afterwards."""
+    network = network.copy()
+    network.output_set = output_set.copy()
+    indices = np.arange(network.get_N())
+    live = np.zeros(network.get_N(), dtype=np.bool_)
+    live[list(output_set)] = True
+    stream_layer = network.ff_layers.layer(0).copy()
+    for d in range(network.get_depth() - 1, -1, -1):
+        perm = np.abs(network.pmatrix[d])
+        keep = (perm != indices) & (live | live[perm])
+        network.pmatrix[d, ~keep] = indices[~keep]
+        stream_layer[d] &= keep
+        live |= keep
+        if live.all():
+            break
+    network.ff_layers.set_layer(0, stream_layer)
+    return generators.Generator().remove_delay_stages(network)
+
+
+class ReferenceBlockAllocator(BlockAllocator):
+    """BlockAllocator summing the FF of each block element-wise instead of
+    looking them up in the summed-area table."""
+
+    def block_sum(self, start_x: int, start_y: int, size_x: int, size_y: int) -> int:
+        return int(
+            np.sum(
+                self.ff_matrix[start_y : start_y + size_y, start_x : start_x + size_x]
+            )
+        )
+
+
+class ReferenceStageAllocator(StageAllocator):
+    """StageAllocator filling the groups of each stage one after another
+    with fill_groups instead of partitioning all stages at once."""
+
+    def allocate_ff_groups(self, network, num_ff_per_group, max_entities):
+        bit_width = network.signals["STREAM"].bit_width
+        points_in_stage = np.sum(network.ff_layers[0], axis=1)
+        self.stage_groups = self.distribute_entities(
+            points_in_stage, ceil(num_ff_per_group / bit_width), bit_width, max_entities
+        )
+        stages = []
+        group_index = 0
+        for y in range(network.get_depth()):
+            if self.stage_groups[y]:
+                xs = np.flatnonzero(network.ff_layers.stage(0, y))
+                group_id, ff_end, _ = fill_groups(
+                    group_index,
+                    group_index + self.stage_groups[y],
+                    num_ff_per_group,
+                    np.full_like(xs, bit_width),
+                )
+                xs = xs[: len(group_id)]
+                stages.append(
+                    FFGroups.from_points(
+                        (xs, np.full_like(xs, y), np.zeros_like(xs)),
+                        ff_end,
+                        group_id,
+                        group_index + self.stage_groups[y],
+                    )
+                )
+                group_index += self.stage_groups[y]
+        return FFGroups.concatenate(stages, group_index)
+
+
+def divide_only(allocator_class):
+    """Returns a subclass of allocator_class recording the leaf blocks instead
+    of distributing their FF to groups. Keeps the number of groups to
+    terminate the division as usual."""
+
+    class DivideOnly(allocator_class):
+        def allocate_ff_groups(self, network, num_ff_per_group, max_entities):
+            self.leaves = []
+            super().allocate_ff_groups(network, num_ff_per_group, max_entities)
+            return self.leaves
+
+        def distribute_to_groups(self, network, block, total_ff, max_ff_per_group):
+            self.leaves.append((block.start, block.size, total_ff))
+            self.num_groups += ceil(total_ff / max_ff_per_group)
+
+    return DivideOnly
+
+
+class Benchmarks:
+    def __compare_create(
+        self,
+        gen: generators.Generator,
+        sizes: list[int],
+        repeat: int,
+        reference_max_N: int,
+    ):
+        rows = []
+        for N in sizes:
+            network, t_new = time_call(gen.create, N, repeat=repeat)
+            t_ref = float("nan")
+            equal = "-"
+            if N <= reference_max_N:
+                reference, t_ref = time_call(gen.create_reference, N, repeat=1)
+                equal = networks_equal(network, reference)
+            rows.append(
+                [
+                    N,
+                    "{:.4f}".format(t_ref),
+                    "{:.4f}".format(t_new),
+                    "{:.1f}".format(t_ref / t_new),
+                    equal,
+                ]
+            )
+        print_table(["N", "reference[s]", "create[s]", "speedup", "identical"], rows)
+
+    def oddeven(
+        self,
+        min_exp: int = 4,
+        max_exp: int = 16,
+        repeat: int = 3,
+        reference_max_exp: int = 16,
+    ):
+        """Compare vectorized and element-wise construction of Odd-Even
+        networks.
+
+        Parameters:
+            min_exp, max_exp: int
+                Networks of N=2**min_exp to N=2**max_exp inputs are created.
+            repeat: int
+                Number of repetitions, the best time is reported.
+            reference_max_exp: int
+                Largest exponent for which the reference is run.
+        """
+        self.__compare_create(
+            generators.OddEven(),
+            [2**p for p in range(min_exp, max_exp + 1)],
+            repeat,
+            2**reference_max_exp,
+        )
+
+    def bitonic(
+        self,
+        min_exp: int = 4,
+        max_exp: int = 14,
+        repeat: int = 3,
+        reference_max_exp: int = 14,
+        non_pow2: bool = False,
+    ):
+        """Compare iterative and recursive construction of Bitonic networks.
+
+        Parameters:
+            min_exp, max_exp: int
+                Networks of N=2**min_exp to N=2**max_exp inputs are created.
+            repeat: int
+                Number of repetitions, the best time is reported.
+            reference_max_exp: int
+                Largest exponent for which the reference is run.
+            non_pow2: bool
+                Use N=2**p + 2**(p-1) - 1 inputs instead of powers of two.
+        """
+        sizes = [2**p for p in range(min_exp, max_exp + 1)]
+        if non_pow2:
+            sizes = [N + N // 2 - 1 for N in sizes]
+        self.__compare_create(
+            generators.Bitonic(), sizes, repeat, 2**reference_max_exp
+        )
+
+    def prune(
+        self,
+        min_exp: int = 4,
+        max_exp: int = 13,
+        cases: int = 20,
+        seed: int = 0,
+    ):
+        """Compare Generator.prune, which derives the pruned network from the
+        given one, against pruning a copy in place for random output sets.
+        Besides output sets of random size, single outputs are pruned, which
+        keep the fewest stages.
+
+        Parameters:
+            min_exp, max_exp: int
+                Networks of N=2**min_exp to N=2**max_exp inputs are pruned.
+            cases: int
+                Number of random output sets per network and size.
+            seed: int
+                Seed of the random output sets.
+        """
+        rng = np.random.default_rng(seed)
+        gen = generators.OddEven()
+        rows = []
+        for p in range(min_exp, max_exp + 1):
+            N = 2**p
+            network = gen.create(N)
+            for outputs in ("random", "single"):
+                sizes = rng.integers(1, N + 1, cases)
+                if outputs == "single":
+                    sizes[:] = 1
+                output_sets = [
+                    set(rng.choice(N, size, replace=False).tolist()) for size in sizes
+                ]
+                references, t_ref = time_call(
+                    lambda: [reference_prune(network, s) for s in output_sets]
+                )
+                pruned, t_prune = time_call(
+                    lambda: [gen.prune(network, s) for s in output_sets]
+                )
+                mismatches = sum(
+                    not networks_equal(a, b) or a.output_set != b.output_set
+                    for a, b in zip(pruned, references)
+                )
+                rows.append(
+                    [
+                        N,
+                        outputs,
+                        "{:.4f}".format(t_ref),
+                        "{:.4f}".format(t_prune),
+                        "{:.1f}".format(t_ref / t_prune),
+                        mismatches,
+                    ]
+                )
+        print_table(
+            ["N", "outputs", "in place[s]", "prune[s]", "speedup", "mismatches"], rows
+        )
+
+    def derive(self, min_exp: int = 4, max_exp: int = 12, seed: int = 0):
+        """Compare Network.derive against the element-wise reference for
+        selections given as slices, ranges and index lists.
+
+        Parameters:
+            min_exp, max_exp: int
+                Networks of N=2**min_exp to N=2**max_exp inputs are derived.
+            seed: int
+                Seed of the random index lists.
+        """
+        rng = np.random.default_rng(seed)
+        gen = generators.OddEven()
+        rows = []
+        for p in range(min_exp, max_exp + 1):
+            N = 2**p
+            network = gen.create(N)
+            depth = network.get_depth()
+            selections = {
+                "all": (None, None),
+                "stage slice": (slice(1, depth - 1), None),
+                "column range": (None, range(N // 2)),
+                "column list": (None, [0, 2, 5, N - 1]),
+                "random lists": (
+                    np.sort(rng.choice(depth, depth // 2, replace=False)).tolist(),
+                    np.sort(rng.choice(N, N // 2, replace=False)).tolist(),
+                ),
+            }
+            for name, (stages, columns) in selections.items():
+                derived, t_derive = time_call(
+                    lambda: network.derive(stages, columns).materialize()
+                )
+                if isinstance(stages, list):
+                    stage_list = stages
+                else:
+                    stage_list = list(range(depth)[stages or slice(None)])
+                column_list = list(range(N)) if columns is None else list(columns)
+                reference, t_ref = time_call(
+                    reference_derive, network, stage_list, column_list
+                )
+                rows.append(
+                    [
+                        N,
+                        name,
+                        "{:.4f}".format(t_ref),
+                        "{:.4f}".format(t_derive),
+                        networks_equal(derived, reference)
+                        and derived.output_set == reference.output_set,
+                    ]
+                )
+        print_table(["N", "selection", "reference[s]", "derive[s]", "identical"], rows)
+
+    def report(
+        self,
+        min_exp: int = 4,
+        max_exp: int = 13,
+        repeat: int = 3,
+        reference_max_exp: int = 13,
+    ):
+        """Compare vectorized report evaluation of Odd-Even networks
+        against the element-wise FF-chain histogram.
+
+        Parameters:
+            min_exp, max_exp: int
+                Networks of N=2**min_exp to N=2**max_exp inputs are evaluated.
+            repeat: int
+                Number of repetitions, the best time is reported.
+            reference_max_exp: int
+                Largest exponent for which the reference is run.
+        """
+        gen = generators.OddEven()
+        rows = []
+        for p in range(min_exp, max_exp + 1):
+            network = gen.create(2**p)
+            report, t_new = time_call(Report, network, repeat=repeat)
+            t_ref = float("nan")
+            equal = "-"
+            if p <= reference_max_exp:
+                reference, t_ref = time_call(reference_ff_hist, network)
+                equal = reference == (
+                    report.content["num_ff"],
+                    report.content["ff_hist"],
+                )
+            rows.append(
+                [
+                    2**p,
+                    "{:.4f}".format(t_ref),
+                    "{:.4f}".format(t_new),
+                    "{:.1f}".format(t_ref / t_new),
+                    equal,
+                ]
+            )
+        print_table(["N", "reference[s]", "report[s]", "speedup", "identical"], rows)
+
+    def replace_ff(
+        self,
+        min_exp: int = 10,
+        max_exp: int = 14,
+        limit: int = 6840,
+        entity_ff: int = 48,
+        SW: int = 1,
+        repeat: int = 1,
+    ):
+        """Compare the division of Odd-Even networks into blocks using the
+        summed-area table against summing each block element-wise. The full
+        allocation including the distribution of FF to groups is timed as well
+        and its groups compared.
+
+        Parameters:
+            min_exp, max_exp: int
+                Networks of N=2**min_exp to N=2**max_exp inputs are allocated.
+            limit: int
+                Maximum number of groups.
+            entity_ff: int
+                Maximum number of FF per group.
+            SW: int
+                Bit width of the stream signal.
+            repeat: int
+                Number of repetitions, the best time is reported.
+        """
+        gen = generators.OddEven()
+        rows = []
+        for p in range(min_exp, max_exp + 1):
+            network = gen.create(2**p)
+            network.signals["STREAM"].bit_width = SW
+            args = (network, entity_ff, limit)
+            leaves, t_new = time_call(
+                divide_only(BlockAllocator)().allocate_ff_groups, *args, repeat=repeat
+            )
+            reference, t_ref = time_call(
+                divide_only(ReferenceBlockAllocator)().allocate_ff_groups,
+                *args,
+                repeat=repeat,
+            )
+            groups, t_alloc = time_call(
+                BlockAllocator().allocate_ff_groups, *args, repeat=repeat
+            )
+            reference_groups = ReferenceBlockAllocator().allocate_ff_groups(*args)
+            rows.append(
+                [
+                    2**p,
+                    len(leaves),
+                    len(groups),
+                    "{:.4f}".format(t_ref),
+                    "{:.4f}".format(t_new),
+                    "{:.1f}".format(t_ref / t_new),
+                    "{:.4f}".format(t_alloc),
+                    leaves == reference and list(groups) == list(reference_groups),
+                ]
+            )
+        print_table(
+            [
+                "N",
+                "blocks",
+                "groups",
+                "reference[s]",
+                "divide[s]",
+                "speedup",
+                "allocate[s]",
+                "identical",
+            ],
+            rows,
+        )
+
+    def fill_groups(
+        self,
+        exp: int = 12,
+        SW: list[int] = [1, 8, 16, 32],
+        entity_ff: int = 48,
+        repeat: int = 3,
+    ):
+        """Compare filling groups with running counters against the
+        element-wise filling. All FF of the stream layer of an Odd-Even network
+        are distributed evenly to groups of at most entity_ff FF in row-major
+        order, like the leaf blocks of the BlockAllocator.
+
+        Parameters:
+            exp: int
+                Network of N=2**exp inputs is used.
+            SW: list[int]
+                Bit widths of the stream signal.
+            entity_ff: int
+                Maximum number of FF per group.
+            repeat: int
+                Number of repetitions, the best time is reported.
+        """
+        network = generators.OddEven().create(2**exp)
+        ys, xs = np.nonzero(network.ff_layers[0])
+        points = (xs, ys, np.zeros_like(xs))
+        rows = []
+        for bit_width in SW:
+            ff_at_points = np.full(len(xs), bit_width)
+            total_ff = len(xs) * bit_width
+            num_groups = ceil(total_ff / entity_ff)
+            target_ff = [total_ff // num_groups] * num_groups
+            for i in range(total_ff % num_groups):
+                target_ff[i] += 1
+
+            def fill():
+                group_id, ff_end, _ = fill_groups(
+                    0, num_groups, target_ff, ff_at_points
+                )
+                return FFGroups.from_points(
+                    (coords[: len(group_id)] for coords in points),
+                    ff_end,
+                    group_id,
+                    num_groups,
+                )
+
+            def fill_reference():
+                groups = [[] for i in range(num_groups)]
+                reference_fill_groups(groups, 0, target_ff, points, ff_at_points)
+                return groups
+
+            groups, t_new = time_call(fill, repeat=repeat)
+            reference, t_ref = time_call(fill_reference, repeat=repeat)
+            rows.append(
+                [
+                    bit_width,
+                    len(xs),
+                    num_groups,
+                    "{:.4f}".format(t_ref),
+                    "{:.4f}".format(t_new),
+                    "{:.1f}".format(t_ref / t_new),
+                    list(groups) == reference,
+                ]
+            )
+        print_table(
+            [
+                "SW",
+                "points",
+                "groups",
+                "reference[s]",
+                "fill[s]",
+                "speedup",
+                "identical",
+            ],
+            rows,
+        )
+
+    def stage_ff(
+        self,
+        min_exp: int = 10,
+        max_exp: int = 13,
+        limit: int = 6840,
+        entity_ff: int = 48,
+        SW: int = 1,
+        repeat: int = 3,
+    ):
+        """Compare the stagewise allocation partitioning all stages at once
+        against filling the groups stage by stage.
+
+        Parameters:
+            min_exp, max_exp: int
+                Networks of N=2**min_exp to N=2**max_exp inputs are allocated.
+            limit: int
+                Maximum number of groups.
+            entity_ff: int
+                Maximum number of FF per group.
+            SW: int
+                Bit width of the stream signal.
+            repeat: int
+                Number of repetitions, the best time is reported.
+        """
+        gen = generators.OddEven()
+        rows = []
+        for p in range(min_exp, max_exp + 1):
+            network = gen.create(2**p)
+            network.signals["STREAM"].bit_width = SW
+            args = (network, entity_ff, limit)
+            groups, t_new = time_call(
+                StageAllocator().allocate_ff_groups, *args, repeat=repeat
+            )
+            reference, t_ref = time_call(
+                ReferenceStageAllocator().allocate_ff_groups, *args, repeat=repeat
+            )
+            rows.append(
+                [
+                    2**p,
+                    network.get_depth(),
+                    len(groups),
+                    "{:.4f}".format(t_ref),
+                    "{:.4f}".format(t_new),
+                    "{:.1f}".format(t_ref / t_new),
+                    list(groups) == list(reference),
+                ]
+            )
+        print_table(
+            [
+                "N",
+                "depth",
+                "groups",
+                "reference[s]",
+                "allocate[s]",
+                "speedup",
+                "identical",
+            ],
+            rows,
+        )
+
+    def cluster_ff(
+        self,
+        min_exp: int = 8,
+        max_exp: int = 12,
+        limit: int = 6840,
+        entity_ff: int = 48,
+        SW: int = 1,
+    ):
+        """Compare the locality of the groups of the ClusterAllocator against
+        the BlockAllocator it starts from, given by the mean and maximum
+        bounding box diagonal of the groups.
+
+        Parameters:
+            min_exp, max_exp: int
+                Networks of N=2**min_exp to N=2**max_exp inputs are allocated.
+            limit: int
+                Maximum number of groups.
+            entity_ff: int
+                Maximum number of FF per group.
+            SW: int
+                Bit width of the stream signal.
+        """
+        gen = generators.OddEven()
+        rows = []
+        for p in range(min_exp, max_exp + 1):
+            network = gen.create(2**p)
+            network.signals["STREAM"].bit_width = SW
+            args = (network, entity_ff, limit)
+            blocks, t_block = time_call(BlockAllocator().allocate_ff_groups, *args)
+            allocator = ClusterAllocator()
+            clusters, t_cluster = time_call(allocator.allocate_ff_groups, *args)
+            row = [2**p, len(clusters)]
+            for groups in (blocks, clusters):
+                diagonals = groups.diagonals()
+                row += [
+                    int(groups.num_ff().sum()),
+                    "{:.1f}".format(diagonals.mean() if len(diagonals) else 0),
+                    "{:.1f}".format(diagonals.max(initial=0)),
+                ]
+            row += [
+                len(allocator.costs) - 1,
+                "{:.4f}".format(t_block),
+                "{:.4f}".format(t_cluster),
+            ]
+            rows.append(row)
+        print_table(
+            [
+                "N",
+                "groups",
+                "block FF",
+                "mean",
+                "max",
+                "cluster FF",
+                "mean",
+                "max",
+                "iterations",
+                "block[s]",
+                "cluster[s]",
+            ],
+            rows,
+        )
+
+    def plan_ff(
+        self,
+        min_exp: int = 8,
+        max_exp: int = 12,
+        dsp: int = 1500,
+        bram: int = 200,
+        srl: int = 20000,
+        SW: int = 8,
+    ):
+        """Compare the FF replaced by the ReplacementPlanner using BRAM, DSP
+        and SRL delay lines against replacing FF with DSPs only.
+
+        Parameters:
+            min_exp, max_exp: int
+                Networks of N=2**min_exp to N=2**max_exp inputs are allocated.
+            dsp, bram, srl: int
+                Budgets of the resources.
+            SW: int
+                Bit width of the stream signal.
+        """
+        path = Path("src/Shift_Registers/")
+        resources = [
+            Resource(
+                parseVHDLEntity(path / "Shift_Register_BRAM.vhd"), bram, 512, 72, 8
+            ),
+            Resource(parseVHDLEntity(path / "Register_DSP.vhd"), dsp, 48),
+            Resource(parseVHDLEntity(path / "Shift_Register.vhd"), srl, 32, 1),
+        ]
+        gen = generators.OddEven()
+        rows = []
+        for p in range(min_exp, max_exp + 1):
+            network = gen.create(2**p)
+            network.signals["STREAM"].bit_width = SW
+            total = network.ff_layers.count(0) * SW + network.ff_layers.count()
+            total -= network.ff_layers.count(0)
+            planner = ReplacementPlanner()
+            dsp_only, t_dsp = time_call(planner.plan, network, resources[1:2])
+            planned, t_plan = time_call(planner.plan, network, resources)
+            replaced = {
+                repl.entity.name: repl.groups.num_ff().sum() for repl in planned
+            }
+            rows.append(
+                [
+                    2**p,
+                    total,
+                    int(dsp_only[0].groups.num_ff().sum()),
+                ]
+                + [int(replaced.get(resource.entity.name, 0)) for resource in resources]
+                + [
+                    "{:.4f}".format(t_dsp),
+                    "{:.4f}".format(t_plan),
+                ]
+            )
+        print_table(
+            [
+                "N",
+                "FF",
+                "DSP only",
+                "BRAM",
+                "DSP",
+                "SRL",
+                "DSP only[s]",
+                "planned[s]",
+            ],
+            rows,
+        )
+
+    def chain_ff(
+        self,
+        min_exp: int = 8,
+        max_exp: int = 13,
+        min_chain: int = 8,
+        SW: int = 1,
+    ):
+        """Compare the number of delay lines of the ChainAllocator replacing
+        the chains of at least min_chain FF against the number of groups of
+        48 FF the BlockAllocator needs for the same FF.
+
+        Parameters:
+            min_exp, max_exp: int
+                Networks of N=2**min_exp to N=2**max_exp inputs are allocated.
+            min_chain: int
+                Minimum length of the chains replaced.
+            SW: int
+                Bit width of the stream signal.
+        """
+        gen = generators.OddEven()
+        rows = []
+        for p in range(min_exp, max_exp + 1):
+            network = gen.create(2**p)
+            network.signals["STREAM"].bit_width = SW
+            # Only the long chains of the stream layer are kept.
+            xs, starts, lengths = network.ff_layers.chains(0)
+            is_long = lengths >= min_chain
+            layer = np.zeros(network.ff_layers.layer(0).shape, dtype=bool)
+            for x, start, length in zip(xs[is_long], starts[is_long], lengths[is_long]):
+                layer[start : start + length, x] = True
+            network.ff_layers = generators.FFLayers.from_array(layer[np.newaxis])
+            args = (network, 48, inf)
+            blocks, t_block = time_call(BlockAllocator().allocate_ff_groups, *args)
+            srl, t_srl = time_call(
+                ChainAllocator(min_chain, 1).allocate_ff_groups, network, 32, inf
+            )
+            bram, t_bram = time_call(
+                ChainAllocator(min_chain, 72).allocate_ff_groups,
+                network,
+                512 * 72,
+                inf,
+            )
+            rows.append(
+                [
+                    2**p,
+                    int(is_long.sum()),
+                    int(lengths[is_long].sum()) * SW,
+                    len(blocks),
+                    len(srl),
+                    len(bram),
+                    "{:.4f}".format(t_block),
+                    "{:.4f}".format(t_srl),
+                    "{:.4f}".format(t_bram),
+                ]
+            )
+        print_table(
+            [
+                "N",
+                "chains",
+                "FF",
+                "DSP groups",
+                "SRL lines",
+                "BRAM lines",
+                "block[s]",
+                "SRL[s]",
+                "BRAM[s]",
+            ],
+            rows,
+        )
+
+    def allocation_cache(
+        self,
+        min_exp: int = 10,
+        max_exp: int = 13,
+        limit: int = 6840,
+        entity_ff: int = 48,
+        repeat: int = 3,
+    ):
+        """Compare the allocation by the BlockAllocator against loading it
+        from an AllocationCache in a temporary directory.
+
+        Parameters:
+            min_exp, max_exp: int
+                Networks of N=2**min_exp to N=2**max_exp inputs are allocated.
+            limit: int
+                Maximum number of groups.
+            entity_ff: int
+                Maximum number of FF per group.
+            repeat: int
+                Number of repetitions, the best time is reported.
+        """
+        entity = parseVHDLEntity(Path("src/Shift_Registers/Register_DSP.vhd"))
+        gen = generators.OddEven()
+        rows = []
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = AllocationCache(cache_dir)
+            for p in range(min_exp, max_exp + 1):
+                network = gen.create(2**p)
+                args = (BlockAllocator(), network, entity, limit, entity_ff)
+                allocated, t_alloc = time_call(
+                    BlockAllocator().reallocate_ff,
+                    network,
+                    entity,
+                    limit,
+                    entity_ff,
+                    repeat=repeat,
+                )
+                # The first call stores the allocation.
+                _, t_store = time_call(cache.reallocate_ff, *args)
+                loaded, t_load = time_call(cache.reallocate_ff, *args, repeat=repeat)
+                rows.append(
+                    [
+                        2**p,
+                        len(loaded.groups),
+                        "{:.4f}".format(t_alloc),
+                        "{:.4f}".format(t_store),
+                        "{:.4f}".format(t_load),
+                        list(loaded.groups) == list(allocated.groups),
+                    ]
+                )
+        print_table(
+            ["N", "groups", "allocate[s]", "store[s]", "load[s]", "identical"],
+            rows,
+        )
+
+    def map_signal(
+        self,
+        min_exp: int = 6,
+        max_exp: int = 13,
+        reference_max_exp: int = 9,
+        max_fanout: int = 0,
+    ):
+        """Compare mapping the START and ENABLE signals of every CS to their
+        nearest source by the lookup tables of the template processor against
+        the outward scan formerly used.
+
+        Parameters:
+            min_exp, max_exp: int
+                Networks of N=2**min_exp to N=2**max_exp inputs are mapped.
+            reference_max_exp: int
+                Largest network mapped by the outward scan as well.
+            max_fanout: int
+                Distribute START with this fanout, if not 0. Otherwise the
+                only sources are at the first input of each stage.
+        """
+        gen = generators.OddEven()
+        signal_names = ["START", "ENABLE"]
+        rows = []
+        for p in range(min_exp, max_exp + 1):
+            network = gen.create(2**p)
+            if max_fanout:
+                network = gen.distribute_signal(network, "START", max_fanout)
+            comparators = network.get_comparators()
+            points = [(low, y) for y, low, high, reverse in comparators]
+
+            def map_all():
+                processor = VHDLTemplateProcessor()
+                return [
+                    processor.map_signal(network, None, name, point)
+                    for name in signal_names
+                    for point in points
+                ]
+
+            mapped, t_table = time_call(map_all)
+            row = [2**p, len(points), "{:.4f}".format(t_table)]
+            if p <= reference_max_exp:
+                layers = [network.signals[name].layer_index for name in signal_names]
+                sources, t_scan = time_call(
+                    lambda: [
+                        reference_stage_source(network, z, point)
+                        for z in layers
+                        for point in points
+                    ]
+                )
+                expected = [
+                    "{}_array({})({})".format(
+                        network.signals[name].name.lower(),
+                        x // network.signals[name].max_fanout,
+                        y,
+                    )
+                    for name, (x, y, z) in zip(
+                        [name for name in signal_names for point in points], sources
+                    )
+                ]
+                row += ["{:.4f}".format(t_scan), mapped == expected]
+            else:
+                row += ["-", "-"]
+            rows.append(row)
+        print_table(["N", "CS", "table[s]", "scan[s]", "identical"], rows)
+
+    def startup(
+        self,
+        module: str = "netgen",
+        repeat: int = 5,
+        top: int = 10,
+        budget_ms: float = 0,
+    ):
+        """Measure the import time of module in a fresh interpreter.
+
+        Parameters:
+            module: str
+                Module to import, relative to the current directory.
+            repeat: int
+                Number of interpreter starts, the best time is reported.
+            top: int
+                Number of slowest imports listed.
+            budget_ms: float
+                Fail if the import takes longer. Disabled if 0.
+        """
+        best = None
+        wall = float("inf")
+        for i in range(max(repeat, 1)):
+            start = time.perf_counter()
+            result = subprocess.run(
+                [sys.executable, "-X", "importtime", "-c", "import " + module],
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            wall = min(wall, time.perf_counter() - start)
+            times = parse_importtime(result.stderr)
+            if best is None or times[module][1] < best[module][1]:
+                best = times
+
+        rows = sorted(best.items(), key=lambda item: item[1][1], reverse=True)
+        print_table(
+            ["module", "self[ms]", "cumulative[ms]"],
+            [
+                [name, "{:.1f}".format(t[0] / 1e3), "{:.1f}".format(t[1] / 1e3)]
+                for name, t in rows[:top]
+            ],
+        )
+        total_ms = best[module][1] / 1e3
+        print("import {}: {:.1f} ms".format(module, total_ms))
+        print("interpreter start and import: {:.1f} ms".format(wall * 1e3))
+
+        loaded = [name for name in LAZY_MODULES if name in best]
+        if loaded:
+            raise SystemExit("Loaded on import: " + ", ".join(loaded))
+        if budget_ms and total_ms > budget_ms:
+            raise SystemExit(
+                "Import took {:.1f} ms, budget is {} ms".format(total_ms, budget_ms)
+            )
+
+
+if __name__ == "__main__":
+    fire.Fire(Benchmarks)
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 import math
 import numpy as np
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from datetime import datetime
 from enum import Enum
 
@@ -11,6 +11,23 @@ def is_in_order(index: int, perm: int):
     return index == abs(perm)
 
 
+def as_selection(selection, size: int):
+    """Converts a selection of indices along an axis of the given size into a
+    slice if the indices are consecutive and an index array otherwise. Slices
+    keep numpy indexing from copying the selected data.
+    """
+    if selection is None:
+        return slice(None)
+    if isinstance(selection, slice):
+        return selection
+    if isinstance(selection, range) and selection.step == 1:
+        return slice(selection.start, selection.stop)
+    indices = np.arange(size)[np.asarray(selection, dtype=np.int64)]
+    if indices.size and np.all(np.diff(indices) == 1):
+        return slice(int(indices[0]), int(indices[-1]) + 1)
+    return indices
+
+
 class DistributionType(Enum):
     GLOBAL = 1
     ONE_TO_ONE = 2
@@ -32,6 +49,328 @@ class NetworkSignal:
     max_fanout: int = 1
 
 
+class ComparatorList:
+    """Sparse representation of the CS elements of a network.
+    CS elements of all stages are stored in flat arrays ordered by stage.
+    The CS elements of stage y are found between stage_ptr[y] and
+    stage_ptr[y + 1]. Each CS element is given by its lower and higher input
+    index and its direction, with reverse CS elements checking a > b instead
+    of a < b.
+    """
+
+    def __init__(
+        self,
+        N: int,
+        stage_ptr: np.ndarray,
+        low: np.ndarray,
+        high: np.ndarray,
+        reverse: np.ndarray,
+    ):
+        self.N = N
+        self.stage_ptr = stage_ptr
+        self.low = low
+        self.high = high
+        self.reverse = reverse
+
+    @classmethod
+    def from_pmatrix(cls, pmatrix: np.ndarray) -> "ComparatorList":
+        """Extracts all CS elements from a permutation matrix."""
+        depth, N = pmatrix.shape
+        perm = np.abs(pmatrix)
+        # A CS element is placed at each index whose value is greater than
+        # the index itself.
+        ys, xs = np.nonzero(perm > np.arange(N))
+        stage_ptr = np.zeros(depth + 1, dtype=np.int64)
+        np.cumsum(np.bincount(ys, minlength=depth), out=stage_ptr[1:])
+        return cls(
+            N,
+            stage_ptr,
+            xs.astype(np.int32),
+            perm[ys, xs].astype(np.int32),
+            pmatrix[ys, xs] < 0,
+        )
+
+    def to_pmatrix(self) -> np.ndarray:
+        """Creates the dense permutation matrix described by the CS elements."""
+        pmatrix = np.tile(np.arange(self.N, dtype=np.int64), (self.get_depth(), 1))
+        ys = self.stage_indices()
+        sign = np.where(self.reverse, -1, 1)
+        pmatrix[ys, self.low] = sign * self.high
+        pmatrix[ys, self.high] = sign * self.low
+        return pmatrix
+
+    def get_N(self) -> int:
+        return self.N
+
+    def get_depth(self) -> int:
+        return self.stage_ptr.shape[0] - 1
+
+    def stage(self, y: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Returns lower indices, higher indices and directions of the CS
+        elements in stage y."""
+        beg, end = self.stage_ptr[y], self.stage_ptr[y + 1]
+        return self.low[beg:end], self.high[beg:end], self.reverse[beg:end]
+
+    def stage_indices(self) -> np.ndarray:
+        """Returns the stage index of each CS element."""
+        return np.repeat(np.arange(self.get_depth()), self.num_cs_per_stage())
+
+    def num_cs_per_stage(self) -> np.ndarray:
+        return np.diff(self.stage_ptr)
+
+    def nbytes(self) -> int:
+        return (
+            self.stage_ptr.nbytes
+            + self.low.nbytes
+            + self.high.nbytes
+            + self.reverse.nbytes
+        )
+
+    def __len__(self):
+        return self.low.shape[0]
+
+    def __iter__(self):
+        """Iterates over all CS elements as (stage, low, high, reverse)."""
+        ys = self.stage_indices()
+        return zip(
+            ys.tolist(), self.low.tolist(), self.high.tolist(), self.reverse.tolist()
+        )
+
+
+# Number of set bits for each byte value.
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+class FFLayers:
+    """Bit-packed storage of the FF layers of a network.
+    Each (layer, stage) row of N flags is packed along the input axis into
+    ceil(N / 8) bytes. Layers are allocated with spare capacity which doubles
+    when exhausted, so adding signal layers doesn't copy the store every time.
+
+    Indexing follows the (z, y, x) = (layer, stage, input) order of the former
+    3D bool array. Reads return unpacked bool arrays which are read-only, hence
+    writes have to index the store directly, f.e. ff_layers[z, y, x] = False.
+
+    Views share the store with the layers they were taken from. A shared store
+    is marked read-only and copied by the first write on either side.
+    """
+
+    def __init__(self, num_layers: int = 1, depth: int = 0, N: int = 0, fill=False):
+        self.N = N
+        self.depth = depth
+        self.num_layers = num_layers
+        self.bits = np.zeros(
+            (max(num_layers, 1), depth, self.__num_bytes(N)), dtype=np.uint8
+        )
+        if fill:
+            self.bits[:num_layers] = self.__pack(np.ones(N, dtype=np.bool_))
+
+    @classmethod
+    def from_array(cls, array: np.ndarray) -> "FFLayers":
+        """Packs a 3D bool array of shape (layers, depth, N)."""
+        num_layers, depth, N = np.shape(array)
+        layers = cls(num_layers, depth, N)
+        layers.bits[:num_layers] = layers.__pack(array)
+        return layers
+
+    def to_array(self) -> np.ndarray:
+        """Unpacks all layers into a 3D bool array of shape (layers, depth, N)."""
+        return self.__unpack(self.bits[: self.num_layers])
+
+    @staticmethod
+    def __num_bytes(N: int) -> int:
+        return (N + 7) // 8
+
+    @staticmethod
+    def __pack(array: np.ndarray) -> np.ndarray:
+        return np.packbits(np.asarray(array, dtype=np.bool_), axis=-1)
+
+    def __unpack(self, bits: np.ndarray) -> np.ndarray:
+        return np.unpackbits(bits, axis=-1, count=self.N).view(np.bool_)
+
+    @property
+    def shape(self) -> tuple[int, int, int]:
+        return (self.num_layers, self.depth, self.N)
+
+    @property
+    def ndim(self) -> int:
+        return 3
+
+    @property
+    def nbytes(self) -> int:
+        return self.bits.nbytes
+
+    def __len__(self):
+        return self.num_layers
+
+    def __iter__(self):
+        for z in range(self.num_layers):
+            yield self.layer(z)
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None:
+            return self.to_array()
+        return self.to_array().astype(dtype)
+
+    def copy(self) -> "FFLayers":
+        layers = FFLayers(0, self.depth, self.N)
+        layers.num_layers = self.num_layers
+        layers.bits = self.bits.copy()
+        return layers
+
+    def view(self, stages=slice(None)) -> "FFLayers":
+        """Returns the layers of the stages selected by a slice or index array.
+        A slice shares the store, which is copied on write."""
+        self.bits.flags.writeable = False
+        layers = FFLayers(0, 0, self.N)
+        layers.num_layers = self.num_layers
+        layers.bits = self.bits[:, stages]
+        layers.depth = layers.bits.shape[1]
+        return layers
+
+    def is_shared(self) -> bool:
+        return not self.bits.flags.writeable
+
+    def materialize(self):
+        """Copies the store if it is shared with other layers."""
+        if self.is_shared():
+            self.bits = self.bits.copy()
+
+    def add_layer(self) -> int:
+        """Appends an empty layer and returns its index. Capacity is doubled
+        if no spare layer is left."""
+        self.materialize()
+        if self.num_layers == self.bits.shape[0]:
+            bits = np.zeros(
+                (2 * self.bits.shape[0],) + self.bits.shape[1:], dtype=np.uint8
+            )
+            bits[: self.num_layers] = self.bits[: self.num_layers]
+            self.bits = bits
+        self.bits[self.num_layers] = 0
+        self.num_layers += 1
+        return self.num_layers - 1
+
+    def __layer_index(self, z: int) -> int:
+        if z < -self.num_layers or z >= self.num_layers:
+            raise IndexError(
+                "FF layer {} out of range for {} layers".format(z, self.num_layers)
+            )
+        return z % self.num_layers
+
+    def layer(self, z: int) -> np.ndarray:
+        """Returns layer z as (depth, N) bool array."""
+        layer = self.__unpack(self.bits[self.__layer_index(z)])
+        layer.flags.writeable = False
+        return layer
+
+    def set_layer(self, z: int, values: np.ndarray):
+        """Overwrites layer z with a (depth, N) bool array or a broadcastable
+        row."""
+        z = self.__layer_index(z)
+        values = np.broadcast_to(values, (self.depth, self.N))
+        self.materialize()
+        self.bits[z] = self.__pack(values)
+
+    def stage(self, z: int, y: int) -> np.ndarray:
+        """Returns row of stage y in layer z as bool array of length N."""
+        row = self.__unpack(self.bits[self.__layer_index(z), y])
+        row.flags.writeable = False
+        return row
+
+    def count(self, z: int = None) -> int:
+        """Returns number of flags set in layer z or in all layers."""
+        if z is None:
+            return int(POPCOUNT[self.bits[: self.num_layers]].sum(dtype=np.int64))
+        return int(POPCOUNT[self.bits[self.__layer_index(z)]].sum(dtype=np.int64))
+
+    def chains(self, z: int = 0) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Run-length encodes each input of layer z along the stages.
+        Returns input index, first stage and length of every chain of
+        consecutive flags, ordered by input and first stage."""
+        # Transposed, so chains are found in order of the inputs.
+        columns = self.layer(z).T.view(np.int8)
+        edges = np.diff(columns, axis=1, prepend=0, append=0)
+        xs, starts = np.nonzero(edges == 1)
+        _, ends = np.nonzero(edges == -1)
+        return xs, starts, ends - starts
+
+    def sum_layers(self, start: int = 0, stop: int = None) -> np.ndarray:
+        """Returns a (depth, N) matrix with the number of flags set at each
+        point in the layers from start to stop."""
+        total = np.zeros((self.depth, self.N), dtype=np.int32)
+        for z in range(self.num_layers)[start:stop]:
+            total += self.__unpack(self.bits[z])
+        return total
+
+    def delete(self, indices, axis: int) -> "FFLayers":
+        """Returns a copy with the stages (axis=1) or inputs (axis=2) given by
+        indices removed, mirroring np.delete."""
+        if axis == 1:
+            layers = FFLayers(0, self.depth, self.N)
+            layers.num_layers = self.num_layers
+            layers.bits = np.delete(self.bits, indices, axis=1)
+            layers.depth = layers.bits.shape[1]
+            return layers
+        if axis == 2:
+            return FFLayers.from_array(np.delete(self.to_array(), indices, axis=2))
+        raise ValueError("FF layers can only be deleted along stages or inputs.")
+
+    def __split_key(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        return key + (slice(None),) * (3 - len(key))
+
+    def __points(self, y, x) -> tuple[np.ndarray, np.ndarray]:
+        """Converts stage and input indices into flat arrays of points."""
+        ys = np.atleast_1d(np.arange(self.depth)[y])
+        xs = np.atleast_1d(np.arange(self.N)[x])
+        if isinstance(y, slice) or isinstance(x, slice):
+            ys, xs = ys[:, np.newaxis], xs[np.newaxis, :]
+        ys, xs = np.broadcast_arrays(ys, xs)
+        return ys.ravel(), xs.ravel()
+
+    def __getitem__(self, key):
+        z, y, x = self.__split_key(key)
+        if isinstance(z, (int, np.integer)):
+            z = self.__layer_index(z)
+            if isinstance(y, (int, np.integer)):
+                if isinstance(x, (int, np.integer)):
+                    x = x % self.N
+                    return bool(self.bits[z, y, x >> 3] & (0x80 >> (x & 7)))
+                return self.stage(z, y)[x]
+            return self.layer(z)[y, x]
+        return self.to_array()[key]
+
+    def __setitem__(self, key, value):
+        self.materialize()
+        z, y, x = self.__split_key(key)
+        if not isinstance(z, (int, np.integer)):
+            array = self.to_array()
+            array[key] = value
+            self.bits[: self.num_layers] = self.__pack(array)
+            return
+        z = self.__layer_index(z)
+        if np.ndim(value) == 0:
+            # Set or clear bits without unpacking.
+            if isinstance(y, (int, np.integer)) and isinstance(x, (int, np.integer)):
+                x = x % self.N
+                if value:
+                    self.bits[z, y, x >> 3] |= 0x80 >> (x & 7)
+                else:
+                    self.bits[z, y, x >> 3] &= ~(0x80 >> (x & 7)) & 0xFF
+                return
+            ys, xs = self.__points(y, x)
+            masks = (0x80 >> (xs & 7)).astype(np.uint8)
+            if value:
+                np.bitwise_or.at(self.bits[z], (ys, xs >> 3), masks)
+            else:
+                np.bitwise_and.at(self.bits[z], (ys, xs >> 3), ~masks)
+            return
+        layer = self.layer(z).copy()
+        layer[y, x] = value
+        self.bits[z] = self.__pack(layer)
+
+
 class Network:
     def __init__(self, N: int = 0, depth: int = 0, SW: int = 1):
         # Name of the underlying algorithm
@@ -45,10 +384,19 @@ class Network:
         # of the conditional permutation performed. Sign of the number indicates
         # direction of the sorting condition , i.e. if CS checks inputs a < b then
         # inverse direction checks a > b.
-        self.pmatrix = np.ones((1, 1), dtype=np.int64)
+        self.__pmatrix = np.ones((1, 1), dtype=np.int64)
         # Layers containing FFs. Purpose/usage is derived from the layer_names list.
-        # Contains 2D np arrays
-        self.ff_layers = np.zeros((1, 1), dtype=np.bool_)
+        # Contains bit-packed 2D layers indexed by (layer, stage, input).
+        self.__ff_layers = FFLayers()
+        # Column selection and comparator mask of a derived network, applied
+        # on first access of the arrays.
+        self.__pending = None
+        # Comparator list of the pmatrix, built on first use. The pmatrix is
+        # kept read-only while cached, so writes have to call materialize,
+        # which drops the list. __cache_lock tells whether the pmatrix is
+        # read-only only because of the cache and not shared.
+        self.__comparators = None
+        self.__cache_lock = False
         # Signal name associated with each layer
         self.signals: dict[str, NetworkSignal] = {}
         self.setup(N, depth, SW)
@@ -60,7 +408,7 @@ class Network:
             self.pmatrix[d] = ident_perm.copy()
         self.output_set = set(range(0, N))
         # Add the first layer containing delay FF
-        self.ff_layers = np.ones([1, depth, N], dtype=np.bool_)
+        self.ff_layers = FFLayers(1, depth, N, fill=True)
         self.signals["STREAM"] = NetworkSignal(
             name="STREAM",
             layer_index=0,
@@ -76,8 +424,7 @@ class Network:
             num_replications=1,
             max_fanout=1,
         )
-        for y in range(self.ff_layers[index].shape[0]):
-            self.ff_layers[index, y, 0] = True
+        self.ff_layers[index, :, :1] = True
         index = self.add_layer("ENABLE")
         self.add_signal(
             signal_name="ENABLE",
@@ -87,8 +434,7 @@ class Network:
             num_replications=1,
             max_fanout=1,
         )
-        for y in range(self.ff_layers[index].shape[0]):
-            self.ff_layers[index, y, 0] = True
+        self.ff_layers[index, :, :1] = True
 
         self.add_signal(
             signal_name="CLK",
@@ -107,6 +453,28 @@ class Network:
             max_fanout=0,
         )
 
+    @property
+    def pmatrix(self) -> np.ndarray:
+        self.__apply_pending()
+        return self.__pmatrix
+
+    @pmatrix.setter
+    def pmatrix(self, pmatrix: np.ndarray):
+        self.__apply_pending()
+        self.__pmatrix = pmatrix
+        self.__comparators = None
+        self.__cache_lock = False
+
+    @property
+    def ff_layers(self) -> FFLayers:
+        self.__apply_pending()
+        return self.__ff_layers
+
+    @ff_layers.setter
+    def ff_layers(self, ff_layers: FFLayers):
+        self.__apply_pending()
+        self.__ff_layers = ff_layers
+
     def add_signal(
         self,
         signal_name,
@@ -129,11 +497,7 @@ class Network:
 
     def add_layer(self, layer_name: str) -> int:
         """Add an additional ff layer with specified purpose/usage through the layer name."""
-        new_layer_index = self.ff_layers.shape[0]
-        self.ff_layers = np.pad(
-            self.ff_layers, ((0, 1), (0, 0), (0, 0)), "constant", constant_values=False
-        )
-        return new_layer_index
+        return self.ff_layers.add_layer()
 
     def get_N(self) -> int:
         return np.shape(self.pmatrix)[1]
@@ -148,18 +512,147 @@ class Network:
     def num_ff_at(self, point: (int, int)):
         x, y = point
         count = 0
-        for layer in self.ff_layers:
-            if layer[y][x]:
+        for z in range(len(self.ff_layers)):
+            if self.ff_layers[z, y, x]:
                 count += 1
         return count
 
     def get_output_set(self):
         return self.output_set
 
+    def get_comparators(self) -> ComparatorList:
+        """Returns the sparse list of CS elements in the network. The list is
+        cached until the pmatrix is replaced or materialized for writing."""
+        if self.__comparators is None:
+            self.__comparators = ComparatorList.from_pmatrix(self.pmatrix)
+            if self.pmatrix.flags.writeable:
+                self.pmatrix.flags.writeable = False
+                self.__cache_lock = True
+        return self.__comparators
+
+    def set_comparators(self, comparators: ComparatorList):
+        """Replaces the CS elements of the network by the ones given."""
+        self.pmatrix = comparators.to_pmatrix()
+        self.pmatrix.flags.writeable = False
+        self.__comparators = comparators
+        self.__cache_lock = True
+
+    def copy(self) -> "Network":
+        """Returns a deep copy of the network."""
+        network = Network()
+        network.algorithm = self.algorithm
+        network.output_config = self.output_config
+        network.output_set = self.output_set.copy()
+        network.pmatrix = self.pmatrix.copy()
+        network.ff_layers = self.ff_layers.copy()
+        network.signals = {
+            name: replace(signal) for name, signal in self.signals.items()
+        }
+        return network
+
+    def view(self) -> "Network":
+        """Returns a network sharing the arrays of this network."""
+        return self.derive()
+
+    def derive(self, stages=None, columns=None, cs_mask=None) -> "Network":
+        """Returns a network derived from this one by a selection of stages,
+        inputs and CS elements. The arrays of both networks are shared as far
+        as possible and marked read-only, the first write to a shared array
+        has to call materialize to get a copy. Generator methods do so.
+
+        Parameters:
+            stages: slice, range or list[int]
+                Stages to keep. Consecutive stages are shared without copying.
+            columns: slice, range or list[int]
+                Inputs to keep. CS elements connected to a removed input are
+                replaced by bypass elements and outputs are renumbered.
+            cs_mask: np.ndarray
+                Bool matrix with the shape of the derived network. CS elements
+                are replaced by bypass elements unless set at both inputs.
+                FF layers are left unchanged.
+        Returns:
+            network: Network
+                The derived network.
+        """
+        stages = as_selection(stages, self.get_depth())
+        columns = as_selection(columns, self.get_N())
+        network = Network()
+        network.algorithm = self.algorithm
+        network.output_config = self.output_config
+        network.output_set = self.output_set.copy()
+        network.signals = {
+            name: replace(signal) for name, signal in self.signals.items()
+        }
+        self.pmatrix.flags.writeable = False
+        self.__cache_lock = False
+        network.__pmatrix = self.pmatrix[stages]
+        network.__ff_layers = self.ff_layers.view(stages)
+        # Index arrays are compared elementwise, so only slices are checked.
+        all_columns = isinstance(columns, slice) and columns == slice(None)
+        if not all_columns:
+            renumber = dict(
+                (int(x), i) for i, x in enumerate(np.arange(self.get_N())[columns])
+            )
+            network.output_set = set(
+                renumber[x] for x in self.output_set if x in renumber
+            )
+        if not all_columns or cs_mask is not None:
+            network.__pending = (columns, cs_mask)
+        return network
+
+    def __apply_pending(self):
+        if self.__pending is None:
+            return
+        columns, cs_mask = self.__pending
+        self.__pending = None
+        pmatrix = self.__pmatrix
+        indices = np.arange(pmatrix.shape[1])
+        if isinstance(columns, slice) and columns == slice(None):
+            # Inputs keep their indices, so only the CS mask is applied.
+            partner_mask = np.take_along_axis(cs_mask, np.abs(pmatrix), axis=1)
+            self.__pmatrix = np.where(cs_mask & partner_mask, pmatrix, indices)
+            return
+        # New index of each input, -1 if the input is removed.
+        renumber = np.full(pmatrix.shape[1], -1, dtype=np.int64)
+        renumber[columns] = np.arange(renumber[columns].shape[0])
+        pmatrix = pmatrix[:, columns]
+        partner = renumber[np.abs(pmatrix)]
+        indices = np.arange(pmatrix.shape[1])
+        keep = partner >= 0
+        if cs_mask is not None:
+            partner_mask = np.take_along_axis(
+                cs_mask, np.where(keep, partner, indices), axis=1
+            )
+            keep &= cs_mask & partner_mask
+        self.__pmatrix = np.where(
+            keep, np.where(pmatrix < 0, -partner, partner), indices
+        )
+        self.__ff_layers = FFLayers.from_array(
+            self.__ff_layers.to_array()[:, :, columns]
+        )
+
+    def is_shared(self) -> bool:
+        """Checks whether the network shares arrays with other networks."""
+        shared = not self.pmatrix.flags.writeable and not self.__cache_lock
+        return shared or self.ff_layers.is_shared()
+
+    def materialize(self) -> "Network":
+        """Copies all arrays shared with other networks and drops the cached
+        comparator list."""
+        if self.__cache_lock:
+            self.pmatrix.flags.writeable = True
+            self.__comparators = None
+            self.__cache_lock = False
+        elif not self.pmatrix.flags.writeable:
+            self.pmatrix = self.pmatrix.copy()
+        self.ff_layers.materialize()
+        return self
+
     def __getitem__(self, key):
         return self.pmatrix.__getitem__(key)
 
     def __setitem__(self, key, value):
+        self.materialize()
         return self.pmatrix.__setitem__(key, value)
 
     def __str__(self):
@@ -240,15 +733,13 @@ class Generator:
         if not num_sig:
             num_sig = 1
         # dist_depth = math.ceil(math.log(num_sig, max_fanout))
-        for y in range(network.get_depth()):
-            for x in range(network.get_N()):
-                if (x + (max_fanout + 1) // 2) % max_fanout != 0:
-                    network.ff_layers[index][y][x] = False
-                else:
-                    network.ff_layers[index][y][x] = True
-            # Deal with remainder
-            if max_fanout * num_sig < network.get_N():
-                network.ff_layers[index][y][-1] = True
+        # Every stage has the same distribution of sources.
+        x = np.arange(network.get_N())
+        sources = (x + (max_fanout + 1) // 2) % max_fanout == 0
+        # Deal with remainder
+        if max_fanout * num_sig < network.get_N():
+            sources[-1] = True
+        network.ff_layers.set_layer(index, sources)
         network.signals[signal_name].distribution = DistributionType.PER_STAGE
         network.signals[signal_name].is_replicated = True
         network.signals[signal_name].num_replications = num_sig
@@ -269,20 +760,14 @@ class Generator:
         return network
 
     def reduce(self, network, N):
-        """Reduces number of inputs of connection matrix to N."""
+        """Returns network with the number of inputs reduced to N."""
         # Nothing to do of target and actual size are the same.
 
         if N == network.get_N():
             return network
-        for s in range(network.get_depth()):
-            for i in range(N):
-                # Look for CS elements whose inputs are outside of the target
-                # size. Replace them with bypass elements.
-                if network.pmatrix[s][i] >= N:
-                    network.pmatrix[s][i] = i
-        # Resize network to target size.
-        diff = range(N, network.get_N())
-        network.pmatrix = np.delete(network.pmatrix, diff, axis=1)
+        # CS elements whose inputs are outside of the target size are
+        # replaced with bypass elements.
+        network = network.derive(columns=range(N))
         network.output_set = set(
             [
                 i
@@ -290,51 +775,55 @@ class Generator:
                 if not is_in_order(i, perm)
             ]
         )
-        num_layers = network.ff_layers.shape[0]
-        network.ff_layers = np.delete(network.ff_layers, diff, axis=2)
-        # for i in range(len(network.ff_layers)):
-        #     network.ff_layers[i] = np.delete(network.ff_layers[i], range(N, old_N), 1)
         return network
 
-    def prune(self, network, new_output_set: set = set()):
-        """Prunes CS elements not belonging to outputs in output_set.
-        Starting at the end of the network, all CS not relevant for sorting
-        elements of the output are pruned. Each stage of the network, wires
-        connected to the outputs through CS elements are added to the set to
-        ensure correctness.
+    def prune(self, network: Network, new_output_set: set = set()) -> Network:
+        """Returns network pruned to the CS elements relevant to the outputs
+        in output_set. Starting at the end of the network, all CS not relevant
+        for sorting elements of the output are pruned. Each stage of the
+        network, wires connected to the outputs through CS elements are added
+        to the set to ensure correctness. Stages left without CS elements are
+        removed. Arrays are shared with the given network, which is left
+        unchanged.
         """
         N = network.get_N()
-        d = network.get_depth()
-
-        network.output_set = new_output_set.copy()
+        depth = network.get_depth()
+        indices = np.arange(N)
+        # CS elements to keep, stages in front of the point at which all
+        # wires are live keep all of them.
+        keep = np.ones((depth, N), dtype=np.bool_)
+        # Mask of wires connected to the outputs through CS elements.
+        live = np.zeros(N, dtype=np.bool_)
+        live[list(new_output_set)] = True
+        first = 0
         # Beginning at the output end of the network...
-        while d >= 0:
-            d -= 1
-            for i in range(N):
-                # ... remove all CS elements not in output_set ...
-                if i in new_output_set:
-                    if not is_in_order(i, network[d][i]):
-                        new_output_set.add(network[d][i])
-                    else:
-                        network.pmatrix[d][i] = i
-                        network.ff_layers[0][d][i] = False
-                elif network[d][i] in new_output_set:
-                    new_output_set.add(i)
-                else:
-                    network.pmatrix[d][i] = i
-                    network.ff_layers[0][d][i] = False
-            # If the output set contains all ports we are done.
-            if len(new_output_set) == N:
+        for d in range(depth - 1, -1, -1):
+            perm = np.abs(network.pmatrix[d])
+            keep[d] = (perm != indices) & (live | live[perm])
+            live |= keep[d]
+            # If the mask contains all ports we are done.
+            if live.all():
+                first = d
                 break
+        has_cs = keep[first:].any(axis=1)
+        has_cs = np.concatenate(
+            (np.any(np.abs(network.pmatrix[:first]) != indices, axis=1), has_cs)
+        )
+        stages = np.flatnonzero(has_cs)
+        # FF of the data path are removed together with the pruned CS.
+        stream_layer = network.ff_layers.layer(0)[stages]
+        stream_layer &= keep[stages] | (stages < first)[:, np.newaxis]
+        pruned = network.derive(stages=stages, cs_mask=keep[stages])
+        pruned.output_set = new_output_set.copy()
+        pruned.ff_layers.set_layer(0, stream_layer)
+        return pruned
 
-        # Remove stages which only contain delay elements.
-        indices = []
-        for i in range(0, network.pmatrix.shape[0]):
-            stage = network.pmatrix[i]
-            if all(is_in_order(j, p) for j, p in enumerate(stage)):
-                indices.append(i)
+    def remove_delay_stages(self, network: Network) -> Network:
+        """Remove stages which only contain delay elements."""
+        comparators = network.get_comparators()
+        indices = np.flatnonzero(comparators.num_cs_per_stage() == 0)
         network.pmatrix = np.delete(network.pmatrix, indices, axis=0)
-        network.ff_layers = np.delete(network.ff_layers, indices, axis=1)
+        network.ff_layers = network.ff_layers.delete(indices, axis=1)
         return network
 
     def make_stagewise(self, network: Network):
@@ -344,15 +833,17 @@ class Generator:
         return network
 
     def exclude_stages(self, network: Network, stage_list: list[int]):
-        """Delete stages with indices given by stage_list."""
-        network.pmatrix = np.delete(network.pmatrix, stage_list, axis=0)
-        network.ff_layers = np.delete(network.ff_layers, stage_list, axis=1)
-        return network
+        """Returns network without the stages with indices given by
+        stage_list. Arrays are shared with the given network."""
+        stages = np.delete(np.arange(network.get_depth()), stage_list)
+        return network.derive(stages=stages)
 
     def include_stages(self, network: Network, stage_list: list[int]):
-        """Remove all but the indices given by stage_list."""
-        stage_list = [i for i in range(network.get_depth()) if i not in stage_list]
-        return self.exclude_stages(network, stage_list)
+        """Returns network with only the stages with indices given by
+        stage_list. Arrays are shared with the given network."""
+        stage_set = set(stage_list)
+        stages = [i for i in range(network.get_depth()) if i in stage_set]
+        return network.derive(stages=stages)
 
 
 class OddEven(Generator):
@@ -363,9 +854,59 @@ class OddEven(Generator):
             "N": "Number of inputs.",
         }
 
+    def stage_partners(self, N: int, p: int, k: int) -> np.ndarray:
+        """Computes the lower indices of all CS elements of a single stage.
+        The partner of each returned index i is i + k.
+
+        Parameters:
+            N: int
+                Number of inputs of the network.
+            p: int
+                Size of the sorted subsequences being merged.
+            k: int
+                Distance between the inputs of each CS element.
+        Returns:
+            indices: np.ndarray
+                Sorted lower indices of the CS elements.
+        """
+        # Starting points of each block of k consecutive CS elements.
+        j = np.arange(k % p, N - k, 2 * k)
+        i = np.arange(0, k)
+        indices = (j[:, np.newaxis] + i[np.newaxis, :]).ravel()
+        # Only keep elements whose partner is inside the network and whose
+        # inputs belong to the same merger of size 2 * p.
+        mask = indices + k < N
+        mask &= indices // (p * 2) == (indices + k) // (p * 2)
+        return indices[mask]
+
     def create(self, N):
         # Adaption of algorithm described at
         # https://en.wikipedia.org/wiki/Batcher_odd%E2%80%93even_mergesort
+        # Instead of visiting each CS element, all elements of a stage are
+        # computed at once using index arithmetic.
+        logp = int(math.ceil((math.log2(N))))
+        depth = logp * (logp + 1) // 2
+        network = Network(N, depth)
+        network.algorithm = self.name
+        d = -1  # Current network depth index
+        for p_e in range(0, logp):
+            p = 2**p_e
+            for k_e in range(p_e, -1, -1):
+                k = 2**k_e
+                d += 1
+                low = self.stage_partners(N, p, k)
+                high = low + k
+                network.pmatrix[d, low] = high
+                network.pmatrix[d, high] = low
+                network.ff_layers[0, d, low] = False
+                network.ff_layers[0, d, high] = False
+        return network
+
+    def create_reference(self, N):
+        """Element-wise construction of the network. Kept as reference for
+        validation and benchmarking of create."""
+        # Adaption of algorithm described at
+        # https://en.wikipedia.org/wiki/Batcher_odd%E2%80%93even_mergesort
 
         logp = int(math.ceil((math.log2(N))))
         depth = logp * (logp + 1) // 2
@@ -384,8 +925,8 @@ class OddEven(Generator):
                         ):
                             network[d][i + j] = i + j + k
                             network[d][i + j + k] = i + j
-                            network.ff_layers[0][d][i + j] = False
-                            network.ff_layers[0][d][i + j + k] = False
+                            network.ff_layers[0, d, i + j] = False
+                            network.ff_layers[0, d, i + j + k] = False
         return network
 
 
@@ -426,8 +967,8 @@ class Bitonic(Generator):
                 else:
                     network[depth][i] = -1 * (i + middle)
                     network[depth][i + middle] = -1 * i
-                network.ff_layers[0][depth][i] = False
-                network.ff_layers[0][depth][i + middle] = False
+                network.ff_layers[0, depth, i] = False
+                network.ff_layers[0, depth, i + middle] = False
             # print(
             #     "\tCalling BMerge({},{},{},{})".format(
             #         low_bound, middle, depth + 1, asc
@@ -450,7 +991,86 @@ class Bitonic(Generator):
     def reduce(self, network, N):
         return network
 
+    def max_pow2_less_N_array(self, N: np.ndarray) -> np.ndarray:
+        """Element-wise max_pow2_less_N for an array of sizes greater than 1."""
+        # frexp returns the exponent e with N - 1 = m * 2**e and 0.5 <= m < 1,
+        # i.e. the bit length of N - 1.
+        _, exponent = np.frexp(N - 1)
+        return np.left_shift(1, exponent - 1).astype(np.int64)
+
+    def sort_depths(self, sizes: np.ndarray) -> dict[int, int]:
+        """Computes the depth at which the final merger of bitonicSort starts
+        for each of the given sizes. Depths only depend on the size of the
+        sub-array, hence they are computed once per distinct size.
+        """
+        # Depth after sorting a sub-array of the size given by the key.
+        sort_end = {0: 0, 1: 0}
+        merge_start = {}
+        for n in np.unique(sizes):
+            n = int(n)
+            merge_start[n] = max(sort_end[n // 2], sort_end[n - n // 2])
+            # A merger of n elements takes ceil(log2(n)) stages.
+            sort_end[n] = merge_start[n] + (n - 1).bit_length()
+        return merge_start
+
     def create(self, N):
+        # Adaption of algorithm described at
+        # https://courses.cs.duke.edu//fall08/cps196.1/Pthreads/bitonic.c
+        # Instead of recursing into each sub-array, all sub-arrays of a
+        # recursion level are processed at once as arrays.
+        logp = int(math.ceil((math.log2(N))))
+        depth = logp * (logp + 1) // 2
+        network = Network(N, depth)
+        network.algorithm = self.name
+
+        # Unroll the recursion of bitonicSort level by level. Each sub-array
+        # is described by its lower bound, size and sorting direction.
+        low = np.zeros(1, dtype=np.int64)
+        size = np.full(1, N, dtype=np.int64)
+        asc = np.ones(1, dtype=np.bool_)
+        sorters = []
+        while size.size:
+            keep = size > 1
+            low, size, asc = low[keep], size[keep], asc[keep]
+            sorters.append((low, size, asc))
+            middle = size // 2
+            low = np.concatenate((low, low + middle))
+            size = np.concatenate((middle, size - middle))
+            asc = np.concatenate((~asc, asc))
+        low, size, asc = (np.concatenate(a) for a in zip(*sorters))
+        merge_start = self.sort_depths(size)
+        start = np.array([merge_start[n] for n in size.tolist()], dtype=np.int64)
+
+        # Unroll the recursion of bitonicMerge level by level starting with
+        # the mergers of all sorters.
+        while size.size:
+            keep = size > 1
+            low, size, start, asc = low[keep], size[keep], start[keep], asc[keep]
+            middle = self.max_pow2_less_N_array(size)
+            # Each merger places N - middle CS elements starting at its lower
+            # bound. Expand them into flat index arrays.
+            counts = size - middle
+            offsets = np.arange(counts.sum()) - np.repeat(
+                np.cumsum(counts) - counts, counts
+            )
+            lower = np.repeat(low, counts) + offsets
+            upper = lower + np.repeat(middle, counts)
+            stage = np.repeat(start, counts)
+            sign = np.where(np.repeat(asc, counts), 1, -1)
+            network.pmatrix[stage, lower] = sign * upper
+            network.pmatrix[stage, upper] = sign * lower
+            network.ff_layers[0, stage, lower] = False
+            network.ff_layers[0, stage, upper] = False
+
+            low = np.concatenate((low, low + middle))
+            size = np.concatenate((middle, size - middle))
+            start = np.concatenate((start + 1, start + 1))
+            asc = np.concatenate((asc, asc))
+        return network
+
+    def create_reference(self, N):
+        """Recursive construction of the network. Kept as reference for
+        validation and benchmarking of create."""
         # Adaption of algorithm described at
         # https://courses.cs.duke.edu//fall08/cps196.1/Pthreads/bitonic.c
         logp = int(math.ceil((math.log2(N))))
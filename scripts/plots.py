@@ -1,13 +1,48 @@
 #!/usr/bin/env python3
+"""Figures of the report data.
+Each figure_* function returns the Figures to render from the report
+DataFrame. A Figure holds the rows of the report it depends on and a
+render function drawing it, so figures can be rendered in parallel and
+skipped if their data didn't change.
+"""
+import matplotlib
+
+# Figures are only written to files, never shown.
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import ast
+import hashlib
+from dataclasses import dataclass, field
+from typing import Callable
 
 
-def figure_luts(df):
-    title = "Network LUTs for Bit-Serial CS"
-    print(title)
+@dataclass
+class Figure:
+    # File name of the figure in build/graphs/.
+    file_name: str
+    title: str
+    render: Callable
+    data: pd.DataFrame = field(default_factory=pd.DataFrame)
+    args: tuple = ()
+
+    def digest(self) -> str:
+        """Hash of everything the rendered figure depends on."""
+        h = hashlib.sha256()
+        h.update(self.render.__qualname__.encode())
+        h.update(repr((self.title, self.args)).encode())
+        h.update(repr(list(self.data.columns)).encode())
+        h.update(pd.util.hash_pandas_object(self.data, index=True).values.tobytes())
+        return h.hexdigest()
+
+    def draw(self, path: str):
+        self.render(self.data, self.title, *self.args)
+        plt.savefig(path, dpi=200)
+        plt.close("all")
+
+
+def render_luts(data: pd.DataFrame, title: str):
     x = np.arange(1, 2**15, 1)
     # Fomulars based on Sorting networks on FPGAs, Mueller et al., 2012.
     p = np.log2(x)
@@ -34,13 +69,13 @@ def figure_luts(df):
     line_handles = [l1, l2]
     plt.legend(handles=line_handles, loc=9, title="FPGAs")
     plt.gca().add_artist(legend0)
-    plt.savefig("build/graphs/" + "Network_LUTs" + ".png", dpi=200)
-    plt.close("all")
 
 
-def figure_ff(df):
-    title = "Network FFs for Bit-Serial CS"
-    print(title)
+def figure_luts(df):
+    return [Figure("Network_LUTs.png", "Network LUTs for Bit-Serial CS", render_luts)]
+
+
+def render_ff(data: pd.DataFrame, title: str):
     x = np.arange(1, 2**15, 1)
     # Fomulars based on Sorting networks on FPGAs, Mueller et al., 2012.
     p = np.log2(x)
@@ -69,103 +104,120 @@ def figure_ff(df):
     line_handles = [l1, l2]
     plt.legend(handles=line_handles, loc=9, title="FPGAs")
     plt.gca().add_artist(legend0)
-    plt.savefig("build/graphs/" + "Network_FF" + ".png", dpi=200)
-    plt.close("all")
 
 
-def figure_cs_distances(df: pd.DataFrame):
-    base_title = "CS Distances"
-    for index, row in df.iterrows():
-        name = index
+def figure_ff(df):
+    return [Figure("Network_FF.png", "Network FFs for Bit-Serial CS", render_ff)]
+
+
+def get_histograms(df: pd.DataFrame) -> pd.DataFrame:
+    """Returns the histograms of the reports in long format with the columns
+    name, hist, bin and count. Reports read from the report store carry them
+    in df.attrs, reports read from a legacy .csv contain them as strings."""
+    if "histograms" in df.attrs:
+        return df.attrs["histograms"]
+    records = []
+    for hist in ["distance_hist", "ff_hist"]:
+        if hist not in df:
+            continue
+        for name, value in df[hist].items():
+            for b, count in ast.literal_eval(value).items():
+                records.append((name, hist, b, count))
+    return pd.DataFrame.from_records(records, columns=["name", "hist", "bin", "count"])
+
+
+def get_histogram_averages(df: pd.DataFrame, hist: str) -> pd.Series:
+    """Returns the average bin of histogram hist for each report."""
+    histograms = get_histograms(df)
+    histograms = histograms[histograms["hist"] == hist]
+    weighted = (histograms["bin"] * histograms["count"]).groupby(histograms["name"])
+    total = histograms.groupby("name")["count"].sum()
+    # Reports with empty histograms average to 0.
+    return (weighted.sum() / total).reindex(df.index, fill_value=0)
+
+
+def render_histogram(data: pd.DataFrame, title: str, xlabel: str, ylabel: str):
+    data.set_index("bin")[["count"]].plot(kind="bar", legend=False)
+    plt.title(title)
+    plt.xlabel(xlabel)
+    plt.ylabel(ylabel)
+
+
+def histogram_figures(df: pd.DataFrame, hist: str, base_title, xlabel, ylabel):
+    """Returns a figure of histogram hist for each report."""
+    histograms = get_histograms(df)
+    histograms = histograms[histograms["hist"] == hist]
+    figures = []
+    for name, group in histograms.groupby("name", sort=False):
         title = name + " " + base_title
-        print(title)
-        cs_dist = row.distance_hist
-        dist_dict = ast.literal_eval(cs_dist)
-        if dist_dict:
-            pd.DataFrame.from_dict(dist_dict, orient="index").plot(kind="bar")
+        data = group[["bin", "count"]].reset_index(drop=True)
+        figures.append(
+            Figure(title + ".png", title, render_histogram, data, (xlabel, ylabel))
+        )
+    return figures
 
-            plt.title(title)
-            plt.xlabel("Distance")
-            plt.ylabel("Number of CS")
-            plt.savefig("build/graphs/" + title + ".png", dpi=200)
-            plt.close("all")
+
+def figure_cs_distances(df: pd.DataFrame):
+    return histogram_figures(
+        df, "distance_hist", "CS Distances", "Distance", "Number of CS"
+    )
 
 
 def figure_ff_chain_lengths(df: pd.DataFrame):
-    base_title = "FF Chain Lengths"
-    for index, row in df.iterrows():
-        name = index
-        title = name + " " + base_title
-        print(title)
-        ff_length = row.ff_hist
-        ff_dict = ast.literal_eval(ff_length)
-        if ff_dict:
-            pd.DataFrame.from_dict(ff_dict, orient="index").plot(kind="bar")
-            plt.title(title)
-            plt.xlabel("Length")
-            plt.ylabel("Occurances")
-            plt.savefig("build/graphs/" + title + ".png", dpi=200)
-            plt.close("all")
+    return histogram_figures(
+        df, "ff_hist", "FF Chain Lengths", "Length", "Occurances"
+    )
+
+
+def render_by_alg_conf(data: pd.DataFrame, title: str, value: str, ylabel: str):
+    data.pivot(columns="alg_conf", index="N", values=[value]).plot()
+    plt.title(title)
+    plt.xlabel("N")
+    plt.ylabel(ylabel)
 
 
 def figure_avg_cs_dists(df: pd.DataFrame):
     title = "Average CS Distances"
-    print(title)
-    avg = lambda x: sum(num * dist for num, dist in x.items()) / (
-        sum(dist for dist in x.values() or 1)
+    data = pd.DataFrame(
+        {
+            "alg_conf": df["algorithm"] + "_" + df["output_config"],
+            "N": df["N"],
+            "avg_dist": get_histogram_averages(df, "distance_hist"),
+        }
     )
-    avg_from_str = lambda x: avg(ast.literal_eval(x))
-    distance_hist = df["distance_hist"]
-    distance_hist = distance_hist.apply(avg_from_str)
-    temp_df = df.assign(avg_dist=distance_hist)
-    alg_conf = df["algorithm"] + "_" + df["output_config"]
-    temp_df = temp_df.assign(alg_conf=alg_conf)
-    temp_df = temp_df.pivot(columns="alg_conf", index="N", values=["avg_dist"])
-
-    temp_df.plot()
-    plt.title(title)
-    plt.xlabel("N")
-    plt.ylabel("Avg. Distance")
-    plt.savefig("build/graphs/" + title + ".png", dpi=200)
-    plt.close("all")
+    return [
+        Figure(
+            title + ".png",
+            title,
+            render_by_alg_conf,
+            data,
+            ("avg_dist", "Avg. Distance"),
+        )
+    ]
 
 
 def figure_avg_ff_lengths(df: pd.DataFrame):
     title = "Average FF Chain Lengths"
-    print(title)
-    avg = lambda x: sum(num * dist for num, dist in x.items()) / (
-        sum(dist for dist in x.values()) or 1
+    data = pd.DataFrame(
+        {
+            "alg_conf": df["algorithm"] + "_" + df["output_config"],
+            "N": df["N"],
+            "avg_ff_length": get_histogram_averages(df, "ff_hist"),
+        }
     )
-    avg_from_str = lambda x: avg(ast.literal_eval(x))
-    ff_hist = df["ff_hist"]
-    ff_hist = ff_hist.apply(avg_from_str)
-    temp_df = df.assign(avg_ff_length=ff_hist)
-    alg_conf = df["algorithm"] + "_" + df["output_config"]
-    temp_df = temp_df.assign(alg_conf=alg_conf)
-    temp_df = temp_df.pivot(columns="alg_conf", index="N", values=["avg_ff_length"])
-
-    temp_df.plot()
-    plt.title(title)
-    plt.xlabel("N")
-    plt.ylabel("Avg. FF-Chain Length")
-    plt.savefig("build/graphs/" + title + ".png", dpi=200)
-    plt.close("all")
-
+    return [
+        Figure(
+            title + ".png",
+            title,
+            render_by_alg_conf,
+            data,
+            ("avg_ff_length", "Avg. FF-Chain Length"),
+        )
+    ]
 
-def figure_luts_single(df):
-    title = "CS of Pruned Networks"
-    print(title)
-    x = np.arange(1, 2**15, 1)
-    # Fomulars based on Sorting networks on FPGAs, Mueller et al., 2012.
-    p = np.log2(x)
-    s = p * (p + 1.0) / 2.0
-    oe_cs = (p * p - p + 4) * np.power(2, p - 2) - 1
-    bitonic_cs = (p * p + p) * np.power(2, p - 2)
-    # LUTs based on implemenation data of bit-serial CS.
-    oe_luts = 2.0 * oe_cs
-    bitonic_luts = 2.0 * bitonic_cs
 
-    ax = df.pivot(columns="output_config", index="N", values=["num_cs"]).plot()
+def render_luts_single(data: pd.DataFrame, title: str):
+    ax = data.pivot(columns="output_config", index="N", values=["num_cs"]).plot()
     plt.title(title)
     plt.xlabel("N")
     plt.ylabel("CS")
@@ -174,8 +226,13 @@ def figure_luts_single(df):
     ax.legend(["Full", "Max", "Median", "Min"])
     # l1 = plt.axhline(y=1182 * 10**3, color="black", label="VU9P")
     # plt.legend(handles=line_handles, loc=9, title="FPGAs")
-    plt.savefig("build/graphs/" + "Pruned_CS" + ".png", dpi=200)
-    plt.close("all")
+
+
+def figure_luts_single(df):
+    data = df[["output_config", "N", "num_cs"]]
+    return [
+        Figure("Pruned_CS.png", "CS of Pruned Networks", render_luts_single, data)
+    ]
 
 
 # def figure_example(df) : PlotWrapper):
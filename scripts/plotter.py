@@ -15,15 +15,26 @@ Plot will be saved in graphs/Naive\ Sequential.pdf.
 
 """
 from pathlib import Path
+import json
+import os
 import pandas as pd
+import matplotlib
+
+# Figures are only written to files, never shown.
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 import fire
 import re
 
+from scripts.reporter import ReportStore
+
 
 class PlotWrapper:
     def __init__(self):
-        if Path("build/report.csv").exists():
+        if Path("build/report.db").exists():
+            with ReportStore("build/report.db") as store:
+                self.df = store.as_df()
+        elif Path("build/report.csv").exists():
             self.df = pd.read_csv("build/report.csv", index_col="name")
         else:
             self.df = pd.DataFrame()
@@ -78,14 +89,58 @@ class PlotWrapper:
     #         self.agg.add_data(fpath)
     #     return self
 
-    def all(self):
-        """Plot all plots defined as functions in plots.py"""
+    def all(self, processes: int = 0, force: bool = False):
+        """Plot all plots defined as figure_* functions in plots.py.
+        Figures are rendered to build/graphs/ by a pool of processes. A
+        figure is skipped if the hash of its data matches the hash recorded
+        for the existing file in build/graphs/hashes.json.
+        Usage: makegraph.py all --processes=4 --force
+        """
         import scripts.plots as p
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+
+        graphs = Path("build/graphs")
+        graphs.mkdir(parents=True, exist_ok=True)
+        hash_file = graphs / "hashes.json"
+        hashes = dict()
+        if hash_file.exists():
+            hashes = json.loads(hash_file.read_text())
 
+        figures = []
         for i in dir(p):
             plot_func = getattr(p, i)
-            if callable(plot_func):
-                plot_func(self.df)
+            if i.startswith("figure_") and callable(plot_func):
+                figures += plot_func(self.df)
+
+        pending = dict()
+        for figure in figures:
+            digest = figure.digest()
+            path = graphs / figure.file_name
+            if not force and path.exists() and hashes.get(figure.file_name) == digest:
+                print("Unchanged:", figure.title)
+            else:
+                pending[figure.file_name] = (figure, digest)
+
+        with ProcessPoolExecutor(max_workers=processes or None) as pool:
+            futures = {
+                pool.submit(figure.draw, str(graphs / file_name)): file_name
+                for file_name, (figure, digest) in pending.items()
+            }
+            for future in as_completed(futures):
+                figure, digest = pending[futures[future]]
+                try:
+                    future.result()
+                except Exception as e:
+                    hashes.pop(figure.file_name, None)
+                    print("Failed:", figure.title, "-", repr(e))
+                    continue
+                hashes[figure.file_name] = digest
+                print(figure.title)
+
+        # Replaced at once, so an interrupted run leaves the old hashes.
+        tmp_file = hash_file.with_suffix(".tmp")
+        tmp_file.write_text(json.dumps(hashes, indent=1, sort_keys=True))
+        os.replace(tmp_file, hash_file)
 
     def print_names(self):
         """Outputs all available column names found in .csv
@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
-import pandas as pd
+import numpy as np
+import sqlite3
 from pathlib import Path
 from scripts.network_generators import Network
-from scripts.resource_allocator import FFReplacement
+from scripts.resource_allocator import FFGroups, FFReplacement
 
 
 class Report:
@@ -22,63 +23,82 @@ class Report:
         # Get number of CS and histograms of FF-chains and compare distances.
         depth = network.get_depth()
         N = network.get_N()
-        num_cs = 0
-        num_ff = 0
-        distance_hist = [0 for i in range(N)]
-        ff_hist = [0 for i in range(depth)]
-        for i in range(depth):
-            for j in range(N):
-                # Each out of order value constitutes a cs.
-                if network[i][j] > j:
-                    num_cs += 1
-                    distance_hist[network[i][j] - j] += 1
-        for j in range(N):
-            i = 0
-            while i < depth:
-                # If flag at that point is "+" or "-", a FF is present at that point.
-                if network.ff_layers[0][i][j]:
-                    bypass_beg = i
-                    bypass_end = i
-                    # How long does the FF-chain (shift register) go ?
-                    while bypass_end < depth and network.ff_layers[0][bypass_end][j]:
-                        bypass_end += 1
-                    bypass_end = bypass_end - 1
-                    num_ff += bypass_end - bypass_beg + 1
-                    ff_hist[bypass_end - bypass_beg] += 1
-                    i = bypass_end
-                i += 1
+        # Each CS of ascending direction is counted.
+        comparators = network.get_comparators()
+        ascending = ~comparators.reverse
+        num_cs = int(np.count_nonzero(ascending))
+        distances = comparators.high[ascending] - comparators.low[ascending]
+        distance_hist = np.bincount(distances, minlength=N)
+        # FF-chains (shift registers) are the runs of FF along each input.
+        _, _, lengths = network.ff_layers.chains(0)
+        num_ff = int(lengths.sum())
+        ff_hist = np.bincount(lengths, minlength=depth + 1)[1:]
 
         self.content["num_cs"] = num_cs
         self.content["distance_hist"] = dict()
         for i in range(N):
             if distance_hist[i]:
-                self.content["distance_hist"][i] = distance_hist[i]
+                self.content["distance_hist"][i] = int(distance_hist[i])
         self.content["num_ff"] = num_ff
         self.content["ff_hist"] = dict()
         for i in range(depth):
             if ff_hist[i]:
-                self.content["ff_hist"][i + 1] = ff_hist[i]
+                self.content["ff_hist"][i + 1] = int(ff_hist[i])
+
+        # FF of each stage, points of the stream layer holding bit_width FF.
+        bit_width = network.signals["STREAM"].bit_width
+        self.stage_ff = network.ff_layers.sum_layers(1).sum(axis=1)
+        self.stage_ff += network.ff_layers.layer(0).sum(axis=1) * bit_width
 
         self.content["ffreplacement"] = "None"
         self.content["num_replacements"] = 0
+        self.content["replacements_per_entity"] = []
         self.content["ff_per_entity"] = 0
         self.content["replaced_ff"] = 0
+        self.content["replaced_ff_per_stage"] = []
+        self.content["mean_group_diagonal"] = 0.0
+        self.content["max_group_diagonal"] = 0.0
 
     def evaluate_ffreplacement(self, ffreplacement: FFReplacement):
-        self.content["ffreplacement"] = ffreplacement.entity.name
-        self.content["num_replacements"] = len(ffreplacement.groups)
-        self.content["ff_per_entity"] = ffreplacement.ff_per_entity
-
-        ff_per_group = []
-        for group in ffreplacement.groups:
-            ff = 0
-            for assignment in group:
-                ff += assignment.ff_range[1] - assignment.ff_range[0]
-            ff_per_group.append(ff)
-        self.content["replaced_ff"] = sum(ff_per_group)
+        self.evaluate_ffreplacements([ffreplacement])
 
-    def as_df(self):
-        name = (
+    def evaluate_ffreplacements(self, ffreplacements: list[FFReplacement]):
+        """Reports the FF replaced by one or several entities together."""
+        if not ffreplacements:
+            return
+        self.content["ffreplacement"] = "+".join(
+            repl.entity.name for repl in ffreplacements
+        )
+        counts = [len(repl.groups) for repl in ffreplacements]
+        self.content["num_replacements"] = sum(counts)
+        self.content["replacements_per_entity"] = counts
+        self.content["ff_per_entity"] = ffreplacements[0].ff_per_entity
+        if len(ffreplacements) > 1:
+            self.content["ff_per_entity"] = [
+                repl.ff_per_entity for repl in ffreplacements
+            ]
+
+        groups = FFGroups.concatenate(
+            [repl.groups for repl in ffreplacements], sum(counts)
+        )
+        self.content["replaced_ff"] = int(groups.num_ff().sum())
+        # Fraction of the FF of each stage which have been replaced.
+        replaced = np.bincount(
+            groups.y,
+            weights=groups.range_end - groups.range_start,
+            minlength=len(self.stage_ff),
+        )
+        fraction = replaced / np.maximum(self.stage_ff, 1)
+        self.content["replaced_ff_per_stage"] = np.round(fraction, 4).tolist()
+        # Bounding box diagonals of the groups measure the routing locality.
+        diagonals = np.concatenate([repl.groups.diagonals() for repl in ffreplacements])
+        if len(diagonals):
+            self.content["mean_group_diagonal"] = round(float(diagonals.mean()), 2)
+            self.content["max_group_diagonal"] = round(float(diagonals.max()), 2)
+
+    def get_name(self) -> str:
+        # Reports are named after the network unless a name was given.
+        name = self.content.get("name") or (
             self.content["algorithm"]
             + "_"
             + str(self.content["N"])
@@ -89,29 +109,184 @@ class Report:
         )
 
         self.content["name"] = name
+        return name
+
+    def as_df(self):
+        # pandas is only loaded when a report is turned into a table.
+        import pandas as pd
+
+        self.get_name()
         data = [self.content]
         return pd.DataFrame.from_records(data, index="name")
 
 
+class ReportStore:
+    """Report table kept in a SQLite database.
+    Reports are upserted by name, columns are added as new report contents
+    appear. Concurrent writers, f.e. parallel sweeps, are serialized by the
+    database lock instead of rewriting a shared file. Rows keep the order in
+    which they were last written.
+
+    Histograms, i.e. report contents given as dict, are stored in long format
+    in a side table with one (name, hist, bin, count) row per bin.
+    """
+
+    def __init__(self, path="build/report.db", timeout: float = 60.0):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Transactions are managed explicitly.
+        self.connection = sqlite3.connect(
+            str(self.path), timeout=timeout, isolation_level=None
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS reports "
+            "(name TEXT PRIMARY KEY, seq INTEGER NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS histograms "
+            "(name TEXT NOT NULL, hist TEXT NOT NULL, bin INTEGER NOT NULL, "
+            "count INTEGER NOT NULL, PRIMARY KEY (name, hist, bin))"
+        )
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def columns(self) -> list[str]:
+        return [
+            row[1] for row in self.connection.execute("PRAGMA table_info(reports)")
+        ]
+
+    @staticmethod
+    def __to_sql(value):
+        if isinstance(value, np.generic):
+            return value.item()
+        if isinstance(value, (list, tuple, set)):
+            return str(value)
+        return value
+
+    def upsert(self, rows: list[dict]):
+        """Inserts report contents containing a "name" or replaces the
+        stored reports of the same names."""
+        rows = list(rows)
+        if not rows:
+            return
+        # The write lock is taken up front, so concurrent writers wait for
+        # each other instead of failing to upgrade a read lock.
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            columns = self.columns()
+            for row in rows:
+                for key, value in row.items():
+                    if key not in columns and not isinstance(value, dict):
+                        self.connection.execute(
+                            'ALTER TABLE reports ADD COLUMN "{}"'.format(key)
+                        )
+                        columns.append(key)
+            (seq,) = self.connection.execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM reports"
+            ).fetchone()
+            for row in rows:
+                seq += 1
+                # Columns missing in the row are cleared, so the row replaces
+                # the stored report completely.
+                keys = ["seq", "name"]
+                keys += [k for k in columns if k not in keys]
+                values = [seq] + [self.__to_sql(row.get(k)) for k in keys[1:]]
+                self.__write_histograms(row)
+                self.connection.execute(
+                    'INSERT INTO reports ({}) VALUES ({}) ON CONFLICT(name) DO '
+                    "UPDATE SET {}".format(
+                        ", ".join('"{}"'.format(k) for k in keys),
+                        ", ".join("?" for k in keys),
+                        ", ".join(
+                            '"{0}" = excluded."{0}"'.format(k)
+                            for k in keys
+                            if k != "name"
+                        ),
+                    ),
+                    values,
+                )
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+
+    def __write_histograms(self, row: dict):
+        self.connection.execute(
+            "DELETE FROM histograms WHERE name = ?", (row["name"],)
+        )
+        self.connection.executemany(
+            "INSERT INTO histograms (name, hist, bin, count) VALUES (?, ?, ?, ?)",
+            [
+                (row["name"], key, int(b), int(count))
+                for key, value in row.items()
+                if isinstance(value, dict)
+                for b, count in value.items()
+            ],
+        )
+
+    def as_df(self):
+        """Returns all reports as DataFrame indexed by name. Histograms are
+        attached in long format as attrs["histograms"]."""
+        import pandas as pd
+
+        df = pd.read_sql_query(
+            "SELECT * FROM reports ORDER BY seq", self.connection, index_col="name"
+        )
+        df = df.drop(columns="seq")
+        df.attrs["histograms"] = self.histograms_df()
+        return df
+
+    def histograms_df(self):
+        """Returns the histograms of all reports with one row per bin and
+        the columns name, hist, bin and count."""
+        import pandas as pd
+
+        return pd.read_sql_query(
+            "SELECT h.name, h.hist, h.bin, h.count FROM histograms h "
+            "JOIN reports r ON h.name = r.name ORDER BY r.seq, h.hist, h.bin",
+            self.connection,
+        )
+
+    def export(self, path="build/report.csv"):
+        """Writes all reports to a .csv or .parquet file. Histograms are
+        written next to it to *stem*_histograms.csv or .parquet."""
+        path = Path(path)
+        df = self.as_df()
+        histograms = df.attrs.pop("histograms")
+        histograms_path = path.with_name(path.stem + "_histograms" + path.suffix)
+        if path.suffix == ".parquet":
+            df.to_parquet(path)
+            histograms.to_parquet(histograms_path, index=False)
+        else:
+            df.to_csv(path)
+            histograms.to_csv(histograms_path, index=False)
+
+
 class Reporter:
     def __init__(self):
         self.current_report = None
         self.current_report_committed = False
-        self.reports = pd.DataFrame()
+        # Contents of the committed reports by name in order of commitment.
+        self.reports: dict[str, dict] = dict()
 
     def commit_report(self):
         if not self.current_report_committed:
-            if self.reports.empty:
-                self.reports = self.current_report.as_df()
-            else:
-                current_df = self.current_report.as_df()
-                self.reports = pd.concat(
-                    [
-                        self.reports[~self.reports.index.isin(
-                            current_df.index)],
-                        current_df,
-                    ]
-                )
+            self.commit(self.current_report)
+
+    def commit(self, report: Report):
+        """Adds report to the aggregated reports, replacing any previous
+        report of the same name."""
+        name = report.get_name()
+        self.reports.pop(name, None)
+        self.reports[name] = report.content.copy()
 
     def report_network(self, network):
         self.current_report = Report(network)
@@ -120,15 +295,11 @@ class Reporter:
     def report_ff_replacement(self, ffreplacement):
         self.current_report.evaluate_ffreplacement(ffreplacement)
 
-    def write_report(self, report_file=""):
-        if not self.reports.empty:
-            fpath = Path(report_file)
-            if fpath.exists():
-                reports = pd.read_csv(str(fpath), index_col="name")
-                reports = pd.concat(
-                    [reports[~reports.index.isin(
-                        self.reports.index)], self.reports]
-                )
-                reports.to_csv(report_file)
-            else:
-                self.reports.to_csv(report_file)
+    def report_ff_replacements(self, ffreplacements):
+        self.current_report.evaluate_ffreplacements(ffreplacements)
+
+    def write_report(self, report_file="build/report.db"):
+        """Upserts all committed reports into the report store."""
+        if self.reports:
+            with ReportStore(report_file) as store:
+                store.upsert(self.reports.values())
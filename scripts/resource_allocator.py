@@ -1,5 +1,10 @@
 #!/usr/bin/env python3
-from math import ceil
+from math import ceil, inf
+from pathlib import Path
+import hashlib
+import os
+import tempfile
+import zipfile
 import numpy as np
 from dataclasses import dataclass
 from abc import ABC, abstractmethod
@@ -33,6 +38,132 @@ class FFAssignment:
     ff_range: tuple[int, int]
 
 
+@dataclass
+class FFGroups:
+    """Columnar storage of the FF assignments of all instances of a replacing
+    entity. Assignment i assigns the FF range_start[i] to range_end[i] at point
+    (x[i], y[i], z[i]) to group group_id[i]. Assignments are ordered by group.
+    Iterating yields the assignments of each group as list of FFAssignments."""
+
+    x: np.ndarray
+    y: np.ndarray
+    z: np.ndarray
+    range_start: np.ndarray
+    range_end: np.ndarray
+    group_id: np.ndarray
+    # Number of groups including groups without assignments.
+    num_groups: int = 0
+
+    @classmethod
+    def from_points(
+        cls,
+        points: tuple[np.ndarray, np.ndarray, np.ndarray],
+        range_end: np.ndarray,
+        group_id: np.ndarray,
+        num_groups: int,
+    ) -> "FFGroups":
+        """Creates groups of assignments beginning at the first FF of each
+        point."""
+        x, y, z = (np.asarray(coords, dtype=np.int32) for coords in points)
+        return cls(
+            x,
+            y,
+            z,
+            np.zeros(len(x), dtype=np.int32),
+            np.asarray(range_end, dtype=np.int32),
+            np.asarray(group_id, dtype=np.int32),
+            num_groups,
+        )
+
+    @classmethod
+    def concatenate(cls, parts: list["FFGroups"], num_groups: int) -> "FFGroups":
+        """Joins the assignments of parts whose group ids are already
+        disjoint and ordered."""
+        columns = [
+            np.concatenate(
+                [getattr(part, name) for part in parts] + [np.zeros(0, np.int32)]
+            )
+            for name in ("x", "y", "z", "range_start", "range_end", "group_id")
+        ]
+        return cls(*columns, num_groups)
+
+    def head(self, num_groups: int) -> "FFGroups":
+        """Returns the first num_groups groups."""
+        end = np.searchsorted(self.group_id, num_groups)
+        return FFGroups(
+            self.x[:end],
+            self.y[:end],
+            self.z[:end],
+            self.range_start[:end],
+            self.range_end[:end],
+            self.group_id[:end],
+            min(self.num_groups, num_groups),
+        )
+
+    def select(self, group_ids: np.ndarray) -> "FFGroups":
+        """Returns the groups given, keeping their order and numbering them
+        consecutively."""
+        group_ids = np.sort(np.asarray(group_ids, dtype=np.int64))
+        new_id = np.full(self.num_groups, -1, dtype=np.int32)
+        new_id[group_ids] = np.arange(len(group_ids))
+        keep = new_id[self.group_id] >= 0
+        return FFGroups(
+            self.x[keep],
+            self.y[keep],
+            self.z[keep],
+            self.range_start[keep],
+            self.range_end[keep],
+            new_id[self.group_id[keep]],
+            len(group_ids),
+        )
+
+    def bounds(self) -> np.ndarray:
+        """Returns the index of the first assignment of each group and the
+        total number of assignments, i.e. group i spans
+        bounds[i]:bounds[i + 1]."""
+        return np.searchsorted(self.group_id, np.arange(self.num_groups + 1))
+
+    def num_ff(self) -> np.ndarray:
+        """Returns the number of FF assigned to each group."""
+        return np.bincount(
+            self.group_id,
+            weights=self.range_end - self.range_start,
+            minlength=self.num_groups,
+        ).astype(np.int64)
+
+    def diagonals(self) -> np.ndarray:
+        """Returns the diagonal of the bounding box of the points of each
+        group in the x-y plane, zero for empty groups."""
+        bounds = self.bounds()
+        is_used = np.diff(bounds) > 0
+        diagonals = np.zeros(self.num_groups)
+        if is_used.any():
+            # Empty groups have no assignments, so the assignments of a used
+            # group reach up to the first assignment of the next used group.
+            begin = bounds[:-1][is_used]
+            size_x = np.maximum.reduceat(self.x, begin) - np.minimum.reduceat(
+                self.x, begin
+            )
+            size_y = np.maximum.reduceat(self.y, begin) - np.minimum.reduceat(
+                self.y, begin
+            )
+            diagonals[is_used] = np.hypot(size_x, size_y)
+        return diagonals
+
+    def __len__(self):
+        return self.num_groups
+
+    def __iter__(self):
+        bounds = self.bounds()
+        points = list(zip(self.x.tolist(), self.y.tolist(), self.z.tolist()))
+        ranges = list(zip(self.range_start.tolist(), self.range_end.tolist()))
+        for begin, end in zip(bounds[:-1], bounds[1:]):
+            yield [
+                FFAssignment(point, ff_range)
+                for point, ff_range in zip(points[begin:end], ranges[begin:end])
+            ]
+
+
 @dataclass
 class FFReplacement:
     """Container wrapping information about ff replacing entities and total
@@ -40,10 +171,220 @@ class FFReplacement:
 
     entity: VHDLEntity
     ff_per_entity: int
-    # Groups is a list with each element representing one instance of the
-    # replacing entity. Each instance is itself a list of multiple assignments
-    # whose total FFs may not exceed ff_per_entity.
-    groups: list[list[FFAssignment]]
+    # Each group represents one instance of the replacing entity and consists
+    # of multiple assignments whose total FFs may not exceed ff_per_entity.
+    groups: FFGroups
+    # Instances of a delay line replace chains of FF of the stream layer as
+    # a whole, only the first and the last stage of each chain is connected.
+    delay_line: bool = False
+
+
+@dataclass
+class Resource:
+    """Budget and capacity of a resource replacing FF. Registers replace
+    single FF, up to capacity FF per instance. Delay lines replace chains of
+    at least min_depth and at most capacity FF of the stream layer, up to
+    width bits in parallel per instance."""
+
+    entity: VHDLEntity
+    # Maximum number of instances.
+    budget: int
+    # FF per instance of a register, stages per instance of a delay line.
+    capacity: int
+    # Bits per instance of a delay line, 0 for registers.
+    width: int = 0
+    min_depth: int = 2
+
+    @property
+    def is_delay_line(self) -> bool:
+        return self.width > 0
+
+    @property
+    def ff_per_entity(self) -> int:
+        if self.is_delay_line:
+            return self.capacity * self.width
+        return self.capacity
+
+
+def fill_groups(
+    grp_i: int, num_groups: int, target_ff, ff_at_points: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, int]:
+    """Adds the FF at a sequence of points in order to the groups beginning
+    with group grp_i. A group is filled until its target number of FF is
+    reached, the last point of a group only contributes the FF still fitting
+    into it. Its remaining FF are not assigned and the next point begins the
+    next group.
+
+    Parameters:
+        grp_i: int
+            Index of the group to operate on. The group is expected to be
+            empty.
+        num_groups: int
+            Number of groups available.
+        target_ff: int or list[int]
+            Maximum number of FF of all groups or of each group.
+        ff_at_points: np.ndarray
+            Number of FF at each point.
+    Returns:
+        group_id: np.ndarray
+            Group of each point assigned. Points are assigned up to the first
+            point not fitting into the available groups.
+        ff_end: np.ndarray
+            Number of FF assigned of each point assigned.
+        grp_i: int
+            Group index of the next group to operate on. Increment happens
+            when the maximum number of FFs of the current group has been
+            reached.
+    """
+    if isinstance(target_ff, int):
+        target_ff = [target_ff] * num_groups
+    ff_end = np.asarray(ff_at_points).tolist()
+    # Index of the last point of each full group.
+    group_ends = []
+    end = 0
+    group_ff = 0
+    while end < len(ff_end) and grp_i < num_groups:
+        group_ff += ff_end[end]
+        end += 1
+        if group_ff >= target_ff[grp_i]:
+            # Group is full, only the FF still fitting in are assigned.
+            ff_end[end - 1] -= group_ff - target_ff[grp_i]
+            group_ends.append(end)
+            group_ff = 0
+            grp_i += 1
+
+    first_group = grp_i - len(group_ends)
+    group_id = first_group + np.searchsorted(group_ends, np.arange(end), "right")
+    return group_id, np.array(ff_end[:end], dtype=np.int32), grp_i
+
+
+def apportion(weights: np.ndarray, budget: int, caps: np.ndarray) -> np.ndarray:
+    """Distributes an integer budget proportionally to weights using the
+    largest remainder method without exceeding caps. Budget left over by
+    capped elements is distributed among the others again (water-filling)
+    until either the budget or all caps are exhausted.
+
+    Parameters:
+        weights: np.ndarray
+            Non-negative weight of each element.
+        budget: int
+            Total number of units to distribute.
+        caps: np.ndarray
+            Maximum number of units of each element.
+    Returns:
+        quota: np.ndarray
+            Number of units assigned to each element.
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    caps = np.asarray(caps, dtype=np.int64)
+    quota = np.zeros(len(caps), dtype=np.int64)
+    budget = min(int(budget), int(caps.sum()))
+    while quota.sum() < budget:
+        is_open = (quota < caps) & (weights > 0)
+        if not is_open.any():
+            break
+        remaining = budget - quota.sum()
+        share = np.zeros(len(caps))
+        share[is_open] = remaining * weights[is_open] / weights[is_open].sum()
+        units = np.floor(share).astype(np.int64)
+        # Units lost by rounding down go to the largest remainders.
+        largest = np.argsort(units - share, kind="stable")
+        units[largest[: remaining - units.sum()]] += 1
+        quota = np.minimum(quota + units, caps)
+    return quota
+
+
+def allocate_delay_lines(
+    network: Network, max_entities: int, depth: int, width: int, min_depth: int = 2
+) -> FFGroups:
+    """Allocates the chains of FF of the stream layer to delay lines. Chains
+    longer than depth are split into pieces of depth stages, pieces shorter
+    than min_depth are left out. Pieces of the same first stage and length
+    share delay lines of up to width bits, a piece may be split between two
+    of them by its bits. If more delay lines result than max_entities, the
+    ones replacing the most FF are kept, which keeps the lower bits of a
+    piece, like the register allocators do.
+
+    Parameters:
+        network: Network
+            Network whose stream layer is allocated.
+        max_entities: int
+            Maximum number of delay lines.
+        depth: int
+            Maximum number of stages of a delay line.
+        width: int
+            Maximum number of bits of a delay line.
+        min_depth: int
+            Minimum number of stages of a delay line.
+    Returns:
+        groups: FFGroups
+            Assignments of each delay line, the FF of each of its pieces
+            ordered by input and stage.
+    """
+    bit_width = network.signals["STREAM"].bit_width
+    xs, starts, lengths = network.ff_layers.chains(0)
+    num_pieces = -(-lengths // depth)
+    piece = np.arange(num_pieces.sum()) - np.repeat(
+        np.cumsum(num_pieces) - num_pieces, num_pieces
+    )
+    xs = np.repeat(xs, num_pieces)
+    starts = np.repeat(starts, num_pieces) + piece * depth
+    lengths = np.minimum(np.repeat(lengths, num_pieces) - piece * depth, depth)
+    keep = lengths >= min_depth
+    # Pieces sharing delay lines are adjacent, longest pieces first.
+    order = np.lexsort((xs[keep], starts[keep], -lengths[keep]))
+    xs, starts, lengths = xs[keep][order], starts[keep][order], lengths[keep][order]
+    if not len(xs):
+        return FFGroups.concatenate([], 0)
+
+    is_new_class = np.ones(len(xs), dtype=bool)
+    is_new_class[1:] = (starts[1:] != starts[:-1]) | (lengths[1:] != lengths[:-1])
+    class_begin = np.flatnonzero(is_new_class)
+    class_id = np.cumsum(is_new_class) - 1
+    # Bit b of a class is bit b % bit_width of its piece b // bit_width and
+    # is delayed by line b // width of the class.
+    first_bit = (np.arange(len(xs)) - class_begin[class_id]) * bit_width
+    first_line = first_bit // width
+    last_line = (first_bit + bit_width - 1) // width
+    lines_per_class = np.maximum.reduceat(last_line, class_begin) + 1
+    line_offset = np.cumsum(lines_per_class) - lines_per_class
+    # Parts of the pieces delayed by one line each.
+    num_parts = last_line - first_line + 1
+    part = np.repeat(np.arange(len(xs)), num_parts)
+    line = np.arange(len(part)) - np.repeat(np.cumsum(num_parts) - num_parts, num_parts)
+    line += first_line[part]
+    range_start = np.maximum(line * width - first_bit[part], 0)
+    range_end = np.minimum((line + 1) * width - first_bit[part], bit_width)
+    line += line_offset[class_id[part]]
+
+    num_lines = int(lines_per_class.sum())
+    line_ff = np.bincount(
+        line, weights=(range_end - range_start) * lengths[part], minlength=num_lines
+    )
+    best = np.argsort(-line_ff, kind="stable")[: min(max_entities, num_lines)]
+    new_id = np.full(num_lines, -1, dtype=np.int64)
+    new_id[np.sort(best)] = np.arange(len(best))
+    line = new_id[line]
+    is_kept = line >= 0
+    part, line = part[is_kept], line[is_kept]
+    range_start, range_end = range_start[is_kept], range_end[is_kept]
+    part_order = np.lexsort((range_start, xs[part], line))
+    part, line = part[part_order], line[part_order]
+    range_start, range_end = range_start[part_order], range_end[part_order]
+
+    # Every FF of a part is assigned.
+    num_ff = lengths[part]
+    index = np.repeat(np.arange(len(part)), num_ff)
+    stage = np.arange(len(index)) - np.repeat(np.cumsum(num_ff) - num_ff, num_ff)
+    return FFGroups(
+        xs[part][index].astype(np.int32),
+        (starts[part][index] + stage).astype(np.int32),
+        np.zeros(len(index), dtype=np.int32),
+        range_start[index].astype(np.int32),
+        range_end[index].astype(np.int32),
+        line[index].astype(np.int32),
+        len(best),
+    )
 
 
 class ResourceAllocator(ABC):
@@ -53,9 +394,14 @@ class ResourceAllocator(ABC):
     @abstractmethod
     def allocate_ff_groups(
         self, network: Network, max_ff_per_group: int, max_entities: int
-    ) -> list[list[FFAssignment]]:
+    ) -> FFGroups:
         pass
 
+    def params(self) -> dict:
+        """Returns the parameters the allocation depends on besides the
+        network, f.e. to tell cached allocations apart."""
+        return {}
+
     def reallocate_ff(self, network, entity, max_entities, ff_per_entity):
         ff_groups = self.allocate_ff_groups(network, ff_per_entity, max_entities)
 
@@ -110,11 +456,27 @@ class Block:
 class BlockAllocator(ResourceAllocator):
     """Allocator performing recursive subdivision of the FFs in the network into
     2d rectangles. Compromises using utilization of the replacement resources to
-    in favor of locality."""
+    in favor of locality.
 
-    def __init__(self):
+    If the division yields more groups than entities available, the groups
+    replacing the most FF are kept. With a locality_weight, each unit of the
+    bounding box diagonal of a group costs as much as that many FF.
+    """
+
+    def __init__(self, locality_weight: float = 0.0):
+        self.locality_weight = locality_weight
         self.ff_matrix = None
-        self.groups: list[list[FFAssignment]] = []
+        # Summed-area table of ff_matrix with a leading row and column of
+        # zeros, i.e. ff_sums[y, x] is the sum of ff_matrix[:y, :x].
+        self.ff_sums = None
+        # Unpacked FF layers, in which the FF of a block are looked up.
+        self.ff_points = None
+        # Assignments of the blocks distributed so far.
+        self.blocks: list[FFGroups] = []
+        self.num_groups = 0
+
+    def params(self) -> dict:
+        return {"locality_weight": self.locality_weight}
 
     def __print_block(self, dim_x, dim_y, block: Block):
         for y in range(dim_y):
@@ -130,37 +492,55 @@ class BlockAllocator(ResourceAllocator):
 
     def allocate_ff_groups(
         self, network: Network, num_ff_per_group: int, max_entities: int
-    ) -> list[list[FFAssignment]]:
+    ) -> FFGroups:
         """Allocate FF present in the entire network (delay and replicated
         signals) to groups later replaced by other means.
         Parameters: network : Network object
                     num_ff_per_group : int
                         Number of a single group may contain
-        Returns:   groups : list[list[FFAssignment]]
-                        List of groups themselves consisting of a list of FFAssignments.
+        Returns:   groups : FFGroups
+                        Assignments of all groups.
         """
 
-        self.groups = []
+        self.blocks = []
+        self.num_groups = 0
         # Create 2d matrix containing total number of FFs at a point.
-        self.ff_matrix = np.sum(network.ff_layers[1:], axis=0, dtype=np.int32)
+        self.ff_matrix = network.ff_layers.sum_layers(1)
         # Stream layer is treated differently as bit_width has to be considered.
         self.ff_matrix += network.ff_layers[0] * network.signals["STREAM"].bit_width
+        depth, N = self.ff_matrix.shape
+        self.ff_sums = np.zeros((depth + 1, N + 1), dtype=np.int64)
+        np.cumsum(self.ff_matrix, axis=0, out=self.ff_sums[1:, 1:])
+        np.cumsum(self.ff_sums[1:, 1:], axis=1, out=self.ff_sums[1:, 1:])
+        self.ff_points = network.ff_layers.to_array()
 
         N = network.get_N()
         depth = network.get_depth()
         # print(N)
         # print(depth)
         # print(self.ff_matrix)
-        # Begin subdivision procedure.
+        # Begin subdivision procedure. The entire network is divided, so the
+        # best groups can be selected afterwards.
         self.divide_block(
-            network, Block(True, (0, 0), (N, depth)), num_ff_per_group, max_entities
+            network, Block(True, (0, 0), (N, depth)), num_ff_per_group, inf
         )
-        if len(self.groups) > max_entities:
-            self.groups = self.groups[:max_entities]
-        # print(self.groups)
+        groups = FFGroups.concatenate(self.blocks, self.num_groups)
+        # print(groups)
         # self.allocate_control_ff(network)
         # print(self.sub_groups)
-        return self.groups
+        return self.select_groups(groups, max_entities)
+
+    def select_groups(self, groups: FFGroups, max_entities: int) -> FFGroups:
+        """Returns the max_entities groups with the highest score, i.e. the
+        number of FF replaced less the locality cost. Groups of equal score
+        are kept in order of the division."""
+        if len(groups) <= max_entities:
+            return groups
+        score = groups.num_ff().astype(np.float64)
+        if self.locality_weight:
+            score -= self.locality_weight * groups.diagonals()
+        best = np.argsort(-score, kind="stable")[:max_entities]
+        return groups.select(best)
 
     def __get_second_half(self, parent: Block, child: Block) -> Block:
         # Figure out axis using coord of child and parent.
@@ -177,6 +557,17 @@ class BlockAllocator(ResourceAllocator):
             (size_x, size_y),
         )
 
+    def block_sum(self, start_x: int, start_y: int, size_x: int, size_y: int) -> int:
+        """Returns the total number of FF in the given rectangle."""
+        end_x = start_x + size_x
+        end_y = start_y + size_y
+        return int(
+            self.ff_sums[end_y, end_x]
+            - self.ff_sums[start_y, end_x]
+            - self.ff_sums[end_y, start_x]
+            + self.ff_sums[start_y, start_x]
+        )
+
     def divide_block(
         self,
         network: Network,
@@ -193,15 +584,12 @@ class BlockAllocator(ResourceAllocator):
             init_block,
         ]
         # print()
-        while blocks and len(self.groups) < max_entities:
+        while blocks and self.num_groups < max_entities:
             # Unpack block into start and end coordinates
             start_x, start_y = blocks[-1].start
             size_x, size_y = blocks[-1].size
             # Total number of FF contained in the block.
-            # TODO: Calculation is only required once.
-            total = np.sum(
-                self.ff_matrix[start_y : start_y + size_y, start_x : start_x + size_x]
-            )
+            total = self.block_sum(start_x, start_y, size_x, size_y)
             # print(blocks[-1], "with", total, "FF is being processed:")
             # self.__print_block(init_block.size[0], init_block.size[1], blocks[-1])
             if not blocks[-1].first_half:
@@ -243,18 +631,9 @@ class BlockAllocator(ResourceAllocator):
                             # print(" " * len(blocks), "\tSecond Half is ", blocks[-1])
 
                 elif total > 0:
-                    half_sum_x = np.sum(
-                        self.ff_matrix[
-                            start_y : start_y + size_y, start_x : start_x + size_x // 2
-                        ]
-                    )
+                    half_sum_x = self.block_sum(start_x, start_y, size_x // 2, size_y)
                     diff_x = abs(total // 2 - half_sum_x)
-                    half_sum_y = np.sum(
-                        self.ff_matrix[
-                            start_y : start_y + size_y // 2,
-                            start_x : start_x + size_x,
-                        ]
-                    )
+                    half_sum_y = self.block_sum(start_x, start_y, size_x, size_y // 2)
                     diff_y = abs(total // 2 - half_sum_y)
                     if diff_x < diff_y or size_y <= 1:
                         start_x += ceil(size_x / 2)
@@ -282,100 +661,45 @@ class BlockAllocator(ResourceAllocator):
             max_ff_per_group : int
                 Number of groups to be created.
          Returns:
-            groups : list[list[FFAssignment]]]
-                List of groups themself consisting of a list of coordinate tuples.
-                Mirrored in the attribute groups.
+            groups : FFGroups
+                Assignments of the groups created for the block, numbered
+                after the groups of previous blocks. Appended to the attribute
+                blocks.
         """
         start_x, start_y = block.start
         end_x, end_y = block.size
         end_x += start_x
         end_y += start_y
         if total_ff == 0:
-            return self.groups
+            return FFGroups.concatenate([], self.num_groups)
         num_groups = ceil(total_ff / max_ff_per_group)
 
         # Number of ff for each group
         target_ff = [total_ff // (num_groups) for i in range(num_groups)]
-        groups = [[] for i in range(num_groups)]
-        index = 0
         # Distribute remainder among groups
         for i in range(total_ff % num_groups):
             target_ff[i] += 1
 
+        # Points are visited along the long edge of the block first and all
+        # layers of a point in order.
+        ff_points = self.ff_points[:, start_y:end_y, start_x:end_x]
         if end_y - start_y < end_x - start_x:
-            for y in range(start_y, end_y):
-                for x in range(start_x, end_x):
-                    index = self.__add_ff_to_group(
-                        network, groups, index, target_ff, x, y
-                    )
+            ys, xs, zs = np.nonzero(ff_points.transpose(1, 2, 0))
         else:
-            for x in range(start_x, end_x):
-                for y in range(start_y, end_y):
-                    index = self.__add_ff_to_group(
-                        network, groups, index, target_ff, x, y
-                    )
-        self.groups += groups
-        return self.groups
-
-    def __add_ff_to_group(
-        self,
-        network: Network,
-        groups: list[list[FFAssignment]],
-        grp_i: int,
-        target_ff: list[int],
-        x: int,
-        y: int,
-    ):
-        """Takes a point and adds FF to group indicated by group index until
-        either the target number of FF is reached or no FF remain at that
-        point.
-
-        Parameters:
-            network: Network
-                Sorting Network on which to work on.
-            groups: list[list[FFAssignment]]
-                List of groups to operate on.
-            grp_i: int
-                Index of the group to operate on.
-            target_ff: list[int]
-                List of maximum numbers of FF per group. Each group index
-                relates to the associated maximum number of FF in target_ff.
-            x: int
-                X coordinate in the network.
-            y: int
-                Y coordinate in the network.
-        Returns:
-            grp_i: int
-                Group index of the next group to operate on. Increment happens
-                when the maximum number of FFs of the current group has been
-                reached but unassigned FFs at the point remain.
-        """
-        for z in range(network.ff_layers.shape[0]):
-            point = (x, y, z)
-            ff_start = 0
-            ff_end = 0
-            while ff_end < network.ff_layers[z, y, x]:
-                ff_at_point = 1
-                if z == 0:
-                    # First layer is the permutation layer of variable data
-                    # width
-                    ff_at_point = network.signals["STREAM"].bit_width
-
-                # Find the current number of FF assigned to the group.
-                cur_group_ff = sum(
-                    [a.ff_range[1] - a.ff_range[0] for a in groups[grp_i]]
-                )
-                # The new endpoint of the range is either the full amount of FF
-                # at that point or at least all FF that still fit into the group.
-                # Since we need the old value of ff_end, make a copy.
-                ff_end_prev = ff_end
-                ff_end = min(ff_at_point, target_ff[grp_i] - cur_group_ff)
-                groups[grp_i].append(FFAssignment(point, (ff_start, ff_end)))
-                ff_start = ff_end_prev
-                if cur_group_ff + ff_end >= target_ff[grp_i]:
-                    # if the group is full increment grp_i.
-                    grp_i += 1
-        return grp_i
+            xs, ys, zs = np.nonzero(ff_points.transpose(2, 1, 0))
+        # First layer is the permutation layer of variable data width.
+        ff_at_points = np.where(zs == 0, network.signals["STREAM"].bit_width, 1)
+        group_id, ff_end, _ = fill_groups(0, num_groups, target_ff, ff_at_points)
+        points = (xs + start_x, ys + start_y, zs)
+        groups = FFGroups.from_points(
+            (coords[: len(group_id)] for coords in points),
+            ff_end,
+            group_id + self.num_groups,
+            self.num_groups + num_groups,
+        )
+        self.blocks.append(groups)
+        self.num_groups += num_groups
+        return groups
 
 
 class StageAllocator(ResourceAllocator):
@@ -383,7 +707,9 @@ class StageAllocator(ResourceAllocator):
 
     def __init__(self):
         self.ff_matrix = None
-        self.groups: list[list[FFAssignment]] = []
+        # Number of groups assigned to each stage.
+        self.stage_groups = None
+        self.groups: FFGroups = None
 
     def __print_block(self, dim_x, dim_y, block: Block):
         for y in range(dim_y):
@@ -399,110 +725,485 @@ class StageAllocator(ResourceAllocator):
 
     def allocate_ff_groups(
         self, network: Network, num_ff_per_group: int, max_entities: int
-    ) -> list[list[FFAssignment]]:
+    ) -> FFGroups:
         """Allocate FF present in the entire network (delay and replicated
         signals) to groups later replaced by other means.
         Parameters: network : Network object
                     num_ff_per_group : int
                         Number of a single group may contain
-        Returns:   groups : list[list[FFAssignment]]
-                        List of groups themselves consisting of a list of FFAssignments.
+                    max_entities : int
+                        Number of groups distributed among the stages in
+                        proportion to their FF.
+        Returns:   groups : FFGroups
+                        Assignments of all groups.
         """
-        max_entities_per_stage = ceil(max_entities / network.get_depth())
-        self.groups = []
         # Create 2d matrix containing total number of FFs at a point, excluding
         # all but the first stream layer due to stagewise allocation handling
         # the other layers differently.
-        self.ff_matrix = network.ff_layers[0] * network.signals["STREAM"].bit_width
-        # Create list of ff per stage.
-        ff_list = np.sum(self.ff_matrix, axis=1)
-        # print(self.ff_matrix)
-        N = network.get_N()
+        bit_width = network.signals["STREAM"].bit_width
+        self.ff_matrix = network.ff_layers[0] * bit_width
         depth = network.get_depth() or 1
+        # Points containing FF in row-major order, i.e. ordered by stage.
+        ys, xs = np.nonzero(self.ff_matrix)
+        points_in_stage = np.bincount(ys, minlength=depth)
+
+        # Every point contributes bit_width FF, so each group consists of the
+        # same number of points, the last only contributing the FF still
+        # fitting into the group. Its remaining FF are not assigned.
+        points_per_group = -(-num_ff_per_group // bit_width)
+        last_ff = num_ff_per_group - (points_per_group - 1) * bit_width
+        self.stage_groups = self.distribute_entities(
+            points_in_stage, points_per_group, bit_width, max_entities
+        )
+        num_groups = int(self.stage_groups.sum())
+
+        # The groups of a stage follow those of the previous stages, each
+        # stage keeps its first stage_groups groups.
+        stage_start = np.searchsorted(ys, np.arange(depth))
+        first_group = np.cumsum(self.stage_groups) - self.stage_groups
+        # Index of each point within its stage.
+        rank = np.arange(len(ys)) - stage_start[ys]
+        stage_group = rank // points_per_group
+        keep = stage_group < self.stage_groups[ys]
+        ff_end = np.where(
+            rank % points_per_group == points_per_group - 1, last_ff, bit_width
+        )
+        self.groups = FFGroups.from_points(
+            (xs[keep], ys[keep], np.zeros(np.count_nonzero(keep), dtype=np.int32)),
+            ff_end[keep],
+            (first_group[ys] + stage_group)[keep],
+            num_groups,
+        )
+        return self.groups
 
-        for y in range(depth):
-            num_groups_in_stage = min(
-                max_entities_per_stage, ceil(ff_list[y] / num_ff_per_group)
-            )
-            self.groups += [[] for i in range(num_groups_in_stage)]
-        group_index = 0
-        # Begin subdivision procedure.
-        for y in range(depth):
-            if len(self.groups) > max_entities:
-                self.groups = self.groups[:max_entities]
+    def distribute_entities(
+        self,
+        points_in_stage: np.ndarray,
+        points_per_group: int,
+        bit_width: int,
+        max_entities: int,
+    ) -> np.ndarray:
+        """Distributes max_entities among the stages, so that as many FF as
+        possible are replaced. Groups never span stages, so only the last
+        group of a stage may be partially filled. Full groups all replace the
+        same number of FF and are assigned first, the budget of each stage
+        being proportional to its FF. Remaining entities go to the largest
+        partially filled groups.
+
+        Returns:
+            stage_groups: np.ndarray
+                Number of groups assigned to each stage.
+        """
+        ff_list = points_in_stage * bit_width
+        full_groups = points_in_stage // points_per_group
+        partial_ff = points_in_stage % points_per_group * bit_width
+        stage_groups = apportion(ff_list, max_entities, full_groups)
+        # Any budget left means all full groups have been assigned.
+        num_partial = min(
+            max_entities - int(stage_groups.sum()),
+            int(np.count_nonzero(partial_ff)),
+        )
+        largest = np.argsort(-partial_ff, kind="stable")[:num_partial]
+        stage_groups[largest] += 1
+        return stage_groups
+
+
+class ClusterAllocator(BlockAllocator):
+    """Allocator clustering FF into compact groups with capacity-constrained
+    k-means. The groups of the BlockAllocator are the initial clusters. Each
+    iteration assigns every FF point to the nearest center with capacity
+    left and moves the centers to the mean of their FF, as long as the sum
+    of squared distances of the FF to their group's mean decreases. Trades
+    allocation time for locality."""
+
+    def __init__(
+        self,
+        locality_weight: float = 0.0,
+        iterations: int = 8,
+        candidates: int = 8,
+        chunk_size: int = 1024,
+    ):
+        super().__init__(locality_weight)
+        # Maximum number of k-means iterations.
+        self.iterations = iterations
+        # Number of nearest centers a point is offered to before the
+        # nearest centers with capacity left are searched again.
+        self.candidates = candidates
+        # Number of points whose distances to all centers are computed at
+        # once.
+        self.chunk_size = chunk_size
+        # Sum of squared distances of the FF to their group's mean, of the
+        # initial groups and after each iteration.
+        self.costs: list[float] = []
+
+    def params(self) -> dict:
+        return super().params() | {
+            "iterations": self.iterations,
+            "candidates": self.candidates,
+            "chunk_size": self.chunk_size,
+        }
+
+    def allocate_ff_groups(
+        self, network: Network, num_ff_per_group: int, max_entities: int
+    ) -> FFGroups:
+        """Allocate FF present in the entire network (delay and replicated
+        signals) to at most max_entities groups of at most num_ff_per_group
+        FF each.
+        Parameters: network : Network object
+                    num_ff_per_group : int
+                        Number of a single group may contain
+        Returns:   groups : FFGroups
+                        Assignments of all groups.
+        """
+        groups = super().allocate_ff_groups(network, num_ff_per_group, max_entities)
+        zs, ys, xs = np.nonzero(self.ff_points)
+        # First layer is the permutation layer of variable data width.
+        ff_at_points = np.where(zs == 0, network.signals["STREAM"].bit_width, 1)
+        points = (xs, ys, zs)
+
+        centers, cost = self.__centers(groups)
+        self.costs = [cost]
+        for i in range(self.iterations):
+            candidate = self.assign(points, ff_at_points, centers, num_ff_per_group)
+            centers, cost = self.__centers(candidate)
+            self.costs.append(cost)
+            if cost >= self.costs[-2]:
+                break
+            groups = candidate
+        return groups
+
+    @staticmethod
+    def __centers(groups: FFGroups) -> tuple[np.ndarray, float]:
+        """Returns the mean of the FF of each group and the sum of squared
+        distances of the FF to their group's mean."""
+        weights = groups.range_end - groups.range_start
+        num_ff = np.maximum(groups.num_ff(), 1)
+        centers = np.stack(
+            [
+                np.bincount(
+                    groups.group_id, weights=coords * weights, minlength=len(groups)
+                )
+                / num_ff
+                for coords in (groups.x, groups.y)
+            ],
+            axis=1,
+        )
+        cost = get_cost(
+            np.stack((groups.x, groups.y), axis=1),
+            centers[groups.group_id],
+            weights,
+        )
+        return centers, cost
+
+    def nearest(self, points: np.ndarray, centers: np.ndarray) -> np.ndarray:
+        """Returns the indices of the nearest centers of each point in order
+        of distance, at most self.candidates per point.
+
+        Points are processed in chunks of neighbouring x coordinates, each
+        only being compared with the centers in an x window around it. The
+        window is widened for the points whose candidates might lie outside
+        of it, so the result is exact.
+        """
+        num = min(self.candidates, len(centers))
+        nearest = np.empty((len(points), num), dtype=np.int64)
+        if not num:
+            return nearest
+        by_x = np.argsort(centers[:, 0], kind="stable")
+        centers_x = centers[by_x, 0]
+        # Initial half width of the window, containing about twice the
+        # candidates of a point on average.
+        span = centers_x[-1] - centers_x[0] + 1
+        init_width = max(span * num / len(centers), 1.0)
+        points_by_x = np.argsort(points[:, 0], kind="stable")
+        for begin in range(0, len(points), self.chunk_size):
+            todo = points_by_x[begin : begin + self.chunk_size]
+            width = init_width
+            while len(todo):
+                chunk = points[todo]
+                low = chunk[:, 0].min() - width
+                high = chunk[:, 0].max() + width
+                window = by_x[
+                    np.searchsorted(centers_x, low) : np.searchsorted(
+                        centers_x, high, "right"
+                    )
+                ]
+                if len(window) >= num:
+                    dist = np.subtract.outer(chunk[:, 0], centers[window, 0]) ** 2
+                    dist += np.subtract.outer(chunk[:, 1], centers[window, 1]) ** 2
+                    indices = np.argpartition(dist, num - 1, axis=1)[:, :num]
+                    dist = np.take_along_axis(dist, indices, axis=1)
+                    order = np.argsort(dist, axis=1, kind="stable")
+                    dist = np.take_along_axis(dist, order, axis=1)
+                    # Centers outside of the window are farther away than
+                    # the window's edge.
+                    margin = np.minimum(chunk[:, 0] - low, high - chunk[:, 0])
+                    is_exact = (dist[:, -1] <= margin**2) | (
+                        len(window) == len(centers)
+                    )
+                    nearest[todo[is_exact]] = window[
+                        np.take_along_axis(indices, order, axis=1)[is_exact]
+                    ]
+                    todo = todo[~is_exact]
+                width *= 2
+        return nearest
+
+    def assign(
+        self,
+        points: tuple[np.ndarray, np.ndarray, np.ndarray],
+        ff_at_points: np.ndarray,
+        centers: np.ndarray,
+        capacity: int,
+    ) -> FFGroups:
+        """Assigns the FF of the points to groups around the centers given,
+        each group containing at most capacity FF. In each round every point
+        with FF left is offered to its next nearest center. A center accepts
+        the offers of the nearest points as long as it has capacity left,
+        the last point accepted may be split. FF are left unassigned once
+        all groups are full.
+        """
+        xs, ys, zs = points
+        coords = np.stack((xs, ys), axis=1).astype(np.float64)
+        remaining = np.asarray(ff_at_points, dtype=np.int64).copy()
+        # First FF of each point not assigned yet.
+        offset = np.zeros(len(remaining), dtype=np.int64)
+        free = np.full(len(centers), capacity, dtype=np.int64)
+        assigned = []
+        while True:
+            open_centers = np.flatnonzero(free > 0)
+            pending = np.flatnonzero(remaining > 0)
+            if not len(open_centers) or not len(pending):
                 break
+            nearest = open_centers[self.nearest(coords[pending], centers[open_centers])]
+            for candidate in nearest.T:
+                is_pending = remaining[pending] > 0
+                p = pending[is_pending]
+                c = candidate[is_pending]
+                if not len(p):
+                    break
+                dist = np.sum((coords[p] - centers[c]) ** 2, axis=1)
+                order = np.lexsort((dist, c))
+                p = p[order]
+                c = c[order]
+                # FF offered to the same center by nearer points.
+                offered = np.cumsum(remaining[p]) - remaining[p]
+                offered -= offered[np.searchsorted(c, c)]
+                accepted = np.clip(free[c] - offered, 0, remaining[p])
+                is_accepted = accepted > 0
+                p = p[is_accepted]
+                c = c[is_accepted]
+                accepted = accepted[is_accepted]
+                assigned.append((p, c, offset[p], offset[p] + accepted))
+                offset[p] += accepted
+                remaining[p] -= accepted
+                free -= np.bincount(c, weights=accepted, minlength=len(free)).astype(
+                    np.int64
+                )
+
+        p, c, start, end = (
+            np.concatenate([a[i] for a in assigned] + [np.zeros(0, np.int64)])
+            for i in range(4)
+        )
+        order = np.lexsort((zs[p], xs[p], ys[p], c))
+        p = p[order]
+        return FFGroups(
+            xs[p].astype(np.int32),
+            ys[p].astype(np.int32),
+            zs[p].astype(np.int32),
+            start[order].astype(np.int32),
+            end[order].astype(np.int32),
+            c[order].astype(np.int32),
+            len(centers),
+        )
+
+
+class ChainAllocator(ResourceAllocator):
+    """Allocator replacing chains of FF of the stream layer with delay lines,
+    a chain of length L being an L-cycle delay. Chains are found by run-length
+    encoding the stream layer, chains shorter than min_length are left to
+    the fabric. Each delay line holds up to width bits and
+    num_ff_per_group // width stages, see allocate_delay_lines."""
+
+    def __init__(self, min_length: int = 8, width: int = 1):
+        self.min_length = min_length
+        self.width = width
+
+    def params(self) -> dict:
+        return {"min_length": self.min_length, "width": self.width}
+
+    def allocate_ff_groups(
+        self, network: Network, num_ff_per_group: int, max_entities: int
+    ) -> FFGroups:
+        depth = max(num_ff_per_group // self.width, 1)
+        return allocate_delay_lines(
+            network, max_entities, depth, self.width, self.min_length
+        )
+
+    def reallocate_ff(self, network, entity, max_entities, ff_per_entity):
+        ff_groups = self.allocate_ff_groups(network, ff_per_entity, max_entities)
+        return FFReplacement(entity, ff_per_entity, ff_groups, delay_line=True)
+
+
+class ReplacementPlanner:
+    """Replaces the FF of a network with several resources in one pass.
+    Resources are used in the order given, each replacing FF left over by
+    the previous ones, so the cheapest resource should come first. Delay
+    lines are allocated by the ChainAllocator, registers by the allocator
+    given. Points whose FF are only partly replaced keep their remaining FF
+    in the fabric."""
+
+    def __init__(self, allocator: ResourceAllocator = None):
+        self.allocator = allocator or BlockAllocator()
+
+    def plan(self, network: Network, resources: list[Resource]) -> list[FFReplacement]:
+        """Returns a replacement of each resource replacing any FF."""
+        # FF not replaced yet.
+        residual = network.copy()
+        replacements = []
+        for resource in resources:
+            if resource.budget <= 0:
+                continue
+            if resource.is_delay_line:
+                allocator = ChainAllocator(resource.min_depth, resource.width)
+                groups = allocator.allocate_ff_groups(
+                    residual, resource.ff_per_entity, resource.budget
+                )
             else:
-                if ff_list[y]:
-                    for x in range(N):
-                        if group_index < len(self.groups):
-                            group_index = self.__add_ff_to_group(
-                                network,
-                                self.groups,
-                                group_index,
-                                num_ff_per_group,
-                                x,
-                                y,
-                            )
-                        else:
-                            break
-                if group_index < len(self.groups) and self.groups[group_index]:
-                    # If the group is not empty after completing stage assignment
-                    # increment the index. Prevents assignment of replacements containing
-                    # ff from multiple stages.
-                    group_index += 1
+                groups = self.allocator.allocate_ff_groups(
+                    residual, resource.capacity, resource.budget
+                )
+            if not groups.num_ff().any():
+                continue
+            for z in np.unique(groups.z).tolist():
+                in_layer = groups.z == z
+                residual.ff_layers[z, groups.y[in_layer], groups.x[in_layer]] = False
+            replacements.append(
+                FFReplacement(
+                    resource.entity,
+                    resource.ff_per_entity,
+                    groups,
+                    resource.is_delay_line,
+                )
+            )
+        return replacements
 
-        return self.groups
 
-    def __add_ff_to_group(
+class AllocationCache:
+    """On-disk cache of FF replacements in build/.cache/allocations/.
+    Each replacement is stored as .npz file named after a fingerprint of
+    everything the allocation depends on: CS elements, FF layers and stream
+    width of the network, class and parameters of the allocator, entity,
+    number of entities and FF per entity. Identical allocations, f.e. of a
+    sweep run again, are loaded instead of computed.
+    """
+
+    # Increment when the allocators change their results.
+    VERSION = 1
+
+    def __init__(self, cache_dir=Path("build/.cache/allocations")):
+        self.cache_dir = Path(cache_dir)
+        self.hits = 0
+        self.misses = 0
+        # Whether the last replacement was loaded from the cache.
+        self.last_hit = False
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / max(self.hits + self.misses, 1)
+
+    def key(
         self,
         network: Network,
-        groups: list[list[FFAssignment]],
-        grp_i: int,
-        max_ff: int,
-        x: int,
-        y: int,
-    ):
-        """Takes a point and adds FF to group indicated by group index until
-        either the target number of FF is reached or no FF remain at that
-        point.
+        allocator: ResourceAllocator,
+        entity: VHDLEntity,
+        max_entities: int,
+        ff_per_entity: int,
+    ) -> str:
+        """Returns the fingerprint of an allocation."""
+        digest = hashlib.sha256()
+        ff_layers = network.ff_layers
+        for array in (network.pmatrix, ff_layers.bits[: ff_layers.num_layers]):
+            array = np.ascontiguousarray(array)
+            digest.update(repr((array.shape, array.dtype.str)).encode())
+            digest.update(memoryview(array).cast("B"))
+        digest.update(
+            repr(
+                (
+                    self.VERSION,
+                    network.signals["STREAM"].bit_width,
+                    type(allocator).__name__,
+                    sorted(allocator.params().items()),
+                    entity.name,
+                    max_entities,
+                    ff_per_entity,
+                )
+            ).encode()
+        )
+        return digest.hexdigest()
 
-        Parameters:
-            network: Network
-                Sorting Network on which to work on.
-            groups: list[list[FFAssignment]]
-                List of groups to operate on.
-            grp_i: int
-                Index of the group to operate on.
-            max_ff: int
-                Maximum numbers of FF per group.
-            x: int
-                X coordinate in the network.
-            y: int
-                Y coordinate in the network.
-        Returns:
-            grp_i: int
-                Group index of the next group to operate on. Increment happens
-                when the maximum number of FFs of the current group has been
-                reached but unassigned FFs at the point remain.
-        """
-        point = (x, y, 0)
-        ff_start = 0
-        ff_end = 0
-        while ff_end < network.ff_layers[0, y, x]:
-            ff_at_point = network.signals["STREAM"].bit_width
-            # Find the current number of FF assigned to the group.
-            cur_group_ff = sum([a.ff_range[1] - a.ff_range[0] for a in groups[grp_i]])
-            # The new endpoint of the range is either the full amount of FF
-            # at that point or at least all FF that still fit into the group.
-            # Since we need the old value of ff_end, make a copy.
-            ff_end_prev = ff_end
-            ff_end = min(ff_at_point, max_ff - cur_group_ff)
-            groups[grp_i].append(FFAssignment(point, (ff_start, ff_end)))
-            ff_start = ff_end_prev
-            if cur_group_ff + ff_end >= max_ff:
-                # if the group is full increment grp_i.
-                grp_i += 1
-        return grp_i
+    def reallocate_ff(
+        self,
+        allocator: ResourceAllocator,
+        network: Network,
+        entity: VHDLEntity,
+        max_entities: int,
+        ff_per_entity: int,
+    ) -> FFReplacement:
+        """Returns allocator.reallocate_ff(...), loaded from the cache if the
+        same allocation has been stored before."""
+        path = self.cache_dir / (
+            self.key(network, allocator, entity, max_entities, ff_per_entity) + ".npz"
+        )
+        try:
+            with np.load(path) as data:
+                groups = FFGroups(
+                    data["x"],
+                    data["y"],
+                    data["z"],
+                    data["range_start"],
+                    data["range_end"],
+                    data["group_id"],
+                    int(data["num_groups"]),
+                )
+                ffrepl = FFReplacement(
+                    entity,
+                    int(data["ff_per_entity"]),
+                    groups,
+                    bool(data["delay_line"]),
+                )
+            self.hits += 1
+            self.last_hit = True
+            return ffrepl
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            # Missing, truncated or unreadable entry, allocate again.
+            pass
+        self.misses += 1
+        self.last_hit = False
+        ffrepl = allocator.reallocate_ff(
+            network,
+            entity=entity,
+            max_entities=max_entities,
+            ff_per_entity=ff_per_entity,
+        )
+        groups = ffrepl.groups
+        # The file is replaced atomically, so concurrent runs never read a
+        # partially written entry.
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir)
+        with os.fdopen(fd, "wb") as tmp:
+            np.savez_compressed(
+                tmp,
+                x=groups.x,
+                y=groups.y,
+                z=groups.z,
+                range_start=groups.range_start,
+                range_end=groups.range_end,
+                group_id=groups.group_id,
+                num_groups=groups.num_groups,
+                ff_per_entity=ffrepl.ff_per_entity,
+                delay_line=ffrepl.delay_line,
+            )
+        os.replace(tmp_path, path)
+        return ffrepl
 
 
 def norm2square(point):
@@ -558,24 +1259,27 @@ def get_distscore_group(nw, group):
     return norm2square(diff)
 
 
-def get_mean(group):
-    mean = np.asarray((0, 0))
-    if group:
-        for x, y in group:
-            mean[0] += x
-            mean[1] += y
-        mean[0] /= len(group)
-        mean[1] /= len(group)
-    return mean
-
-
-def get_cost(group, point=None):
-    if not point:
-        point = get_mean(point)
-    cost = 0
-    for gpoint in group:
-        cost += norm2square(gpoint - point)
-    return cost
+def get_mean(group, weights=None):
+    """Returns the mean of the (x, y) points of a group, weighted by the
+    number of FF at each point if given."""
+    points = np.asarray(group, dtype=np.float64).reshape(-1, 2)
+    if not len(points):
+        return np.zeros(2)
+    return np.average(points, axis=0, weights=weights)
+
+
+def get_cost(group, point=None, weights=None):
+    """Returns the sum of squared distances of the (x, y) points of a group
+    to point, by default the mean of the group. point may also give a point
+    for each point of the group. Distances are weighted by the number of FF
+    at each point if given."""
+    points = np.asarray(group, dtype=np.float64).reshape(-1, 2)
+    if point is None:
+        point = get_mean(points, weights)
+    dist = np.sum((points - point) ** 2, axis=1)
+    if weights is not None:
+        dist = dist * weights
+    return float(dist.sum())
 
 
 def print_layer(layer):
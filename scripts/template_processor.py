@@ -1,10 +1,38 @@
 #!/usr/bin/env python3
 from pathlib import Path
+from dataclasses import dataclass
 import numpy as np
 
 from scripts.vhdl import VHDLEntity, VHDLTemplate, parseVHDLEntity
 from scripts.network_generators import Network, NetworkSignal, DistributionType
-from scripts.resource_allocator import FFReplacement, FFAssignment
+from scripts.resource_allocator import FFGroups, FFReplacement
+
+
+@dataclass
+class ReplacementInterface:
+    """Names of the generics and ports of an entity replacing FF."""
+
+    # Generic setting the number of bits, None if the ports are single bits.
+    width: str
+    # Generic setting the number of stages delayed, None for registers.
+    depth: str
+    enable: str
+    input: str
+    output: str
+
+
+# Interfaces of the entities in src/Shift_Registers/ replacing FF.
+REPLACEMENT_INTERFACES = {
+    "REGISTER_DSP": ReplacementInterface(
+        "NUM_INPUTS", None, "ENABLE_I", "REG_I", "REG_O"
+    ),
+    "SHIFT_REGISTER_BRAM": ReplacementInterface(
+        "N", "W", "E", "SER_INPUT", "SER_OUTPUT"
+    ),
+    "SHIFT_REGISTER": ReplacementInterface(
+        None, "LENGTH", "E", "SER_INPUT", "SER_OUTPUT"
+    ),
+}
 
 
 class VHDLTemplateWriter:
@@ -105,6 +133,26 @@ class VHDLTemplateWriter:
         return False
 
 
+def nearest_sources(layer: np.ndarray, axis: int) -> np.ndarray:
+    """Returns for each point of a (depth, N) bool layer the index of the
+    nearest point set in the same stage (axis=1) or the same input (axis=0),
+    -1 if there is none. Of two points in the same distance, the one of the
+    higher index is nearest.
+    """
+    size = layer.shape[axis]
+    shape = [1, 1]
+    shape[axis] = size
+    index = np.broadcast_to(np.arange(size, dtype=np.int32).reshape(shape), layer.shape)
+    # Closest points set at or before and at or after each point.
+    before = np.maximum.accumulate(np.where(layer, index, -1), axis=axis)
+    after = np.flip(
+        np.minimum.accumulate(np.flip(np.where(layer, index, size), axis), axis=axis),
+        axis,
+    )
+    use_after = (after < size) & ((before < 0) | (after - index <= index - before))
+    return np.where(use_after, after, before)
+
+
 def __list_points_in_distance(
     start_point: tuple[int, int], dist=int, bounds=tuple[int, int]
 ) -> list[tuple[int, int]]:
@@ -155,6 +203,22 @@ class VHDLTemplateProcessor:
         self.writer: VHDLTemplateWriter
         # Mapped dimension order. Relevant during code generation.
         self.mdim_order: tuple[int, int, int] = (0, 1, 2)
+        # Nearest sources of the layers of a network, see nearest_sources.
+        # Built once for each layer and axis of the network below.
+        self.__source_network: Network = None
+        self.__source_tables: dict[tuple[int, int], np.ndarray] = {}
+
+    def __get_source_table(self, network: Network, z: int, axis: int) -> np.ndarray:
+        """Returns the nearest sources of layer z along axis."""
+        if self.__source_network is not network:
+            self.__source_network = network
+            self.__source_tables = {}
+        key = (z, axis)
+        if key not in self.__source_tables:
+            self.__source_tables[key] = nearest_sources(
+                network.ff_layers.layer(z), axis
+            )
+        return self.__source_tables[key]
 
     def __map_dim(self, point: list[int]):
         mapped_point = list(point)
@@ -198,42 +262,19 @@ class VHDLTemplateProcessor:
                 return True, source_point
             return False, source_point
         if assoc_signal.distribution == DistributionType.PER_STAGE:
-            # Find the closest source in the same stage.
-            if network.ff_layers[z, y, x]:
-                # Found source at point given. Nothing to do.
-                return True, source_point
-            # Otherwise, search in the x-axis for a source, increasing
-            # distance searched.
-            dist = 1
-            while x - dist >= 0 or x + dist < network.ff_layers.shape[2]:
-                if x + dist < network.ff_layers.shape[2]:
-                    # print(x + dist, network.ff_layers[z, y, x + dist])
-                    if network.ff_layers[z, y, x + dist]:
-                        return True, (x + dist, y, z)
-                if x - dist >= 0:
-                    # print(x - dist, network.ff_layers[z, y, x - dist])
-                    if network.ff_layers[z, y, x - dist]:
-                        return True, (x - dist, y, z)
-                dist += 1
-            return False, (-1, -1, -1)
+            # Closest source in the same stage, looked up in the table of
+            # the layer.
+            source_x = int(self.__get_source_table(network, z, 1)[y, x])
+            if source_x < 0:
+                return False, (-1, -1, -1)
+            return True, (source_x, y, z)
 
         if assoc_signal.distribution == DistributionType.PER_LINE:
-            if network.ff_layers[z, y, x]:
-                # Found source at point given. Nothing to do.
-                return True, source_point
-            # Find the closest source in the same line.
-            dist = 1
-            while y - dist >= 0 or y + dist < network.ff_layers.shape[2]:
-                if y + dist < network.ff_layers.shape[2]:
-                    # print(x + dist, network.ff_layers[z, y, x + dist])
-                    if network.ff_layers[z, y + dist, x]:
-                        return True, (x, y + dist, z)
-                if y - dist >= 0:
-                    # print(x - dist, network.ff_layers[z, y, x - dist])
-                    if network.ff_layers[z, y - dist, x]:
-                        return True, (x, y - dist, z)
-                dist += 1
-            return False, (-1, -1, -1)
+            # Closest source in the same line.
+            source_y = int(self.__get_source_table(network, z, 0)[y, x])
+            if source_y < 0:
+                return False, (-1, -1, -1)
+            return True, (x, source_y, z)
 
         if assoc_signal.distribution == DistributionType.PER_AREA:
             # Search for valid sources in a growing square around the point.
@@ -517,6 +558,8 @@ class VHDLTemplateProcessor:
         tokens: dict[str, str],
         x: int,
         y: int,
+        partner: int,
+        reverse: bool,
     ):
         """Creates CS instance in the network at the point provided. Specific
         CS implementation is provided through the entities dict with port
@@ -524,11 +567,8 @@ class VHDLTemplateProcessor:
         respectively. Instantiation string is written to file through the
         writer object.
         """
-        stage = network.pmatrix[y]
-        instance_name = "CS_STAGE{stage}_{a}_TO_{b}".format(
-            stage=y, a=x, b=abs(stage[x])
-        )
-        if stage[x] < 0:
+        instance_name = "CS_STAGE{stage}_{a}_TO_{b}".format(stage=y, a=x, b=partner)
+        if reverse:
             instance_name += "_REVERSE"
 
         generics = {
@@ -538,14 +578,14 @@ class VHDLTemplateProcessor:
 
         ports = {}
         ports["A_I"] = "stream_array({})({})".format(x, y)
-        ports["B_I"] = "stream_array({})({})".format(stage[x], y)
+        ports["B_I"] = "stream_array({})({})".format(partner, y)
 
         # Swap and Compare direction is indicated by the sign.
-        if stage[x] > 0:
+        if not reverse:
             ports["A_O"] = "stream_array({})({})".format(x, y + 1)
-            ports["B_O"] = "stream_array({})({})".format(stage[x], y + 1)
+            ports["B_O"] = "stream_array({})({})".format(partner, y + 1)
         else:
-            ports["A_O"] = "stream_array({})({})".format(stage[x], y + 1)
+            ports["A_O"] = "stream_array({})({})".format(partner, y + 1)
             ports["B_O"] = "stream_array({})({})".format(x, y + 1)
 
         # Start signal is usally replicated and distributed in another layer.
@@ -574,20 +614,15 @@ class VHDLTemplateProcessor:
         entities: dict[str, VHDLEntity],
         tokens: dict[str, str],
     ):
-        """Iterates over permutation matrix and calls __make_cs for each point
-        containing un-ordered index.
+        """Iterates over the CS elements of the network and calls __make_cs
+        for each of them.
         """
         self.writer.write_start_comment("Generated CS Network")
-        for y in range(network.pmatrix.shape[0]):
-            stage = network.pmatrix[y]
-            for x in range(stage.shape[0]):
-                if abs(stage[x]) > x:
-                    # The value at each index in the stage represents the index
-                    # with which the current index has to be compared to.
-                    # A CS is only placed when index and value differ.
-                    # As a CS handles two indices, only place an element if
-                    # the value is greater than the index.
-                    self.__make_cs(network, template, entities, tokens, x, y)
+        # The comparator list only contains the lower index of each CS
+        # together with its partner and direction, so bypassed indices
+        # don't have to be visited.
+        for y, low, high, reverse in network.get_comparators():
+            self.__make_cs(network, template, entities, tokens, low, y, high, reverse)
         self.writer.write_end_comment()
 
     def __instantiate_ff_replacements(
@@ -603,80 +638,89 @@ class VHDLTemplateProcessor:
         of those replacements.
         """
         self.writer.write_start_comment("Generated FF Replacements")
+        # Signal associated with each layer other than the stream layer.
+        layer_signals = {}
+        for s in network.signals.values():
+            layer_signals.setdefault(s.layer_index, s)
+        replacement_id = 0
         for repl in ff_replacements:
-            replacement_id = 0
+            interface = REPLACEMENT_INTERFACES.get(
+                repl.entity.name, REPLACEMENT_INTERFACES["REGISTER_DSP"]
+            )
+            groups = repl.groups
+            xs, ys, zs = groups.x, groups.y, groups.z
+            # Special handling of the first layer, whose points keep the FF
+            # not replaced.
+            in_stream = zs == 0
+            np.subtract.at(
+                stream_layer_ff,
+                (ys[in_stream], xs[in_stream]),
+                (groups.range_end - groups.range_start)[in_stream],
+            )
+            if repl.delay_line:
+                ports_in, ports_out, depths = self.__get_delay_line_ports(
+                    groups, interface
+                )
+            else:
+                ports_in, ports_out, depths = self.__get_register_ports(
+                    groups, interface, layer_signals
+                )
+
+            # Replaced points are removed from the network, except for points
+            # of the stream layer still containing FF.
+            is_replaced = np.array([port is not None for port in ports_in], dtype=bool)
+            is_replaced[in_stream] = stream_layer_ff[ys[in_stream], xs[in_stream]] == 0
+            for z in np.unique(zs[is_replaced]).tolist():
+                in_layer = is_replaced & (zs == z)
+                network.ff_layers[z, ys[in_layer], xs[in_layer]] = False
+            # Replaced points are no sources anymore.
+            self.__source_tables = {}
+
+            # Group center coordinates used to determine mapping of control
+            # signals.
+            bounds = groups.bounds()
+            group_size = np.maximum(np.diff(bounds), 1)
+            centers_x = (
+                np.bincount(groups.group_id, weights=xs, minlength=len(groups))
+                // group_size
+            )
+            centers_y = (
+                np.bincount(groups.group_id, weights=ys, minlength=len(groups))
+                // group_size
+            )
+
             # Each group represents one instance of the replacement.
-            for group in repl.groups:
+            for begin, end, c_x, c_y in zip(
+                bounds[:-1].tolist(),
+                bounds[1:].tolist(),
+                centers_x.astype(int).tolist(),
+                centers_y.astype(int).tolist(),
+            ):
+                if begin == end:
+                    continue
                 ports = {}
                 for key in repl.entity.ports:
                     ports[key] = ""
-                ports["ENABLE_I"] = "'1'"
-                ports.pop("REG_O")
-                ports.pop("REG_I")
-                reg_index = 0
-                # Group center coordinates used to determine mapping of
-                # control signals.
-                c_x, c_y = (0, 0)
-                reg_ports_in = {}
-                reg_ports_out = {}
-                for assignment in group:
-                    x, y, z = assignment.point
-
-                    c_x += x
-                    c_y += y
-
-                    start, end = assignment.ff_range
-                    # Special handling of the first layer
-                    if z == 0:
-                        for z_i in range(start, end):
-                            mx, my, mz = self.__map_dim([x, y, z_i])
-                            reg_ports_in[
-                                "REG_I({})".format(reg_index)
-                            ] = "stream_array({x})({y})({z})".format(x=mx, y=my, z=mz)
-                            reg_ports_out[
-                                "REG_O({})".format(reg_index)
-                            ] = "stream_array({x})({y})({z})".format(
-                                x=mx, y=my + 1, z=mz
-                            )
-                        stream_layer_ff[y][x] -= end - start
-                        if stream_layer_ff[y][x] == 0:
-                            network.ff_layers[z, y, x] = False
-                    else:
-                        signal = None
-                        for s in network.signals.values():
-                            if s.layer_index == z:
-                                signal = s
-                                break
-                        if not signal:
-                            print(
-                                "Layer {} without associated NetworkSignal object!".format(
-                                    z
-                                )
-                            )
-                            continue
-                        mx, my, mz = self.__map_dim([x, y, z_i])
-                        reg_ports_in[
-                            "REG_I({})".format(reg_index)
-                        ] = "{signal_name}_array({x})({y})".format(
-                            signal_name=signal.name.lower(),
-                            x=mx,
-                            y=my,
-                        )
-                        reg_ports_out[
-                            "REG_O({})".format(reg_index)
-                        ] = "{signal_name}_array({x})({y})".format(
-                            signal_name=signal.name.lower(),
-                            x=mx,
-                            y=my + 1,
-                        )
-                        network.ff_layers[z, y, x] = False
-                    reg_index += 1
-                # Done with assigning ports in this group.
+                ports[interface.enable] = "'1'"
+                ports.pop(interface.output)
+                ports.pop(interface.input)
+                data_ports_in = {}
+                data_ports_out = {}
+                for port_in, port_out in zip(ports_in[begin:end], ports_out[begin:end]):
+                    if port_in is None:
+                        continue
+                    for bit_in, bit_out in zip(port_in, port_out):
+                        name = interface.input
+                        if interface.width:
+                            name += "({})".format(len(data_ports_in))
+                        data_ports_in[name] = bit_in
+                        name = interface.output
+                        if interface.width:
+                            name += "({})".format(len(data_ports_out))
+                        data_ports_out[name] = bit_out
 
                 # Use group center to determine signal sources for items in
                 # port list without explicit assignment.
-                c_x = c_x // len(group)
-                c_y = c_y // len(group)
                 for port, assign in ports.items():
                     if not assign:
                         signal_name = port.split("_")[0].upper()
@@ -686,16 +730,107 @@ class VHDLTemplateProcessor:
 
                 name = "REPL_" + str(replacement_id)
                 replacement_id += 1
-                generics = {"NUM_INPUTS": str(reg_index)}
+                instance_generics = {}
+                if interface.width:
+                    instance_generics[interface.width] = str(len(data_ports_in))
+                if interface.depth:
+                    instance_generics[interface.depth] = str(depths[begin])
                 self.writer.write_incremental(
                     repl.entity.as_instance_manual(
-                        name, generics, ports | reg_ports_in | reg_ports_out
+                        name,
+                        instance_generics,
+                        ports | data_ports_in | data_ports_out,
                     )
                 )
         self.writer.write_end_comment()
 
         return stream_layer_ff
 
+    def __get_register_ports(
+        self,
+        groups: FFGroups,
+        interface: ReplacementInterface,
+        layer_signals: dict[int, NetworkSignal],
+    ) -> tuple[list, list, list]:
+        """Returns the input and output signals of each assignment to
+        registers, None for assignments of layers without signal. Only the
+        last FF of the range replaced at a point of the stream layer is
+        connected."""
+        xs, ys, zs = groups.x, groups.y, groups.z
+        mx, my, mz = self.__map_dim(
+            [xs, ys, np.where(zs == 0, groups.range_end - 1, zs)]
+        )
+        ports_in = []
+        ports_out = []
+        for x, y, z, m_x, m_y, m_z in zip(
+            xs.tolist(),
+            ys.tolist(),
+            zs.tolist(),
+            mx.tolist(),
+            my.tolist(),
+            mz.tolist(),
+        ):
+            if z == 0:
+                ports_in.append(
+                    ["stream_array({x})({y})({z})".format(x=m_x, y=m_y, z=m_z)]
+                )
+                ports_out.append(
+                    ["stream_array({x})({y})({z})".format(x=m_x, y=m_y + 1, z=m_z)]
+                )
+            elif z in layer_signals:
+                signal_name = layer_signals[z].name.lower()
+                ports_in.append(
+                    [
+                        "{signal_name}_array({x})({y})".format(
+                            signal_name=signal_name, x=m_x, y=m_y
+                        )
+                    ]
+                )
+                ports_out.append(
+                    [
+                        "{signal_name}_array({x})({y})".format(
+                            signal_name=signal_name, x=m_x, y=m_y + 1
+                        )
+                    ]
+                )
+            else:
+                print("Layer {} without associated NetworkSignal object!".format(z))
+                ports_in.append(None)
+                ports_out.append(None)
+        return ports_in, ports_out, [None] * len(xs)
+
+    def __get_delay_line_ports(
+        self, groups: FFGroups, interface: ReplacementInterface
+    ) -> tuple[list, list, list]:
+        """Returns the input and output signals and the depth of the delay
+        lines. The assignments of a group form parts, each delaying a range
+        of bits of a chain of the stream layer. The bits are connected at
+        the first assignment of the part and skipped at the others."""
+        xs, ys = groups.x, groups.y
+        is_first = np.ones(len(xs), dtype=bool)
+        is_first[1:] = (
+            (xs[1:] != xs[:-1])
+            | (groups.range_start[1:] != groups.range_start[:-1])
+            | (groups.group_id[1:] != groups.group_id[:-1])
+        )
+        first = np.flatnonzero(is_first)
+        part_length = np.diff(np.append(first, len(xs)))
+        ports_in = [[] for _ in range(len(xs))]
+        ports_out = [[] for _ in range(len(xs))]
+        depths = np.repeat(part_length, part_length).tolist()
+        for i, length in zip(first.tolist(), part_length.tolist()):
+            x, y = int(xs[i]), int(ys[i])
+            for bit in range(int(groups.range_start[i]), int(groups.range_end[i])):
+                m_x, m_y, m_b = self.__map_dim([x, y, bit])
+                ports_in[i].append(
+                    "stream_array({x})({y})({b})".format(x=m_x, y=m_y, b=m_b)
+                )
+                m_x, m_y, m_b = self.__map_dim([x, y + length, bit])
+                ports_out[i].append(
+                    "stream_array({x})({y})({b})".format(x=m_x, y=m_y, b=m_b)
+                )
+        return ports_in, ports_out, depths
+
     def __process_reg_chains(
         self,
         network: Network,
@@ -1083,12 +1218,13 @@ class VHDLTemplateProcessorStagewise(VHDLTemplateProcessor):
         if dsp_repl:
             num_reg_per_dsp = dsp_repl.ff_per_entity
             # print(dsp_repl)
-            for group in dsp_repl.groups:
-                # We assume that all assignments in a group have the same
-                # y-index as they should be in the same stage
-                if group:
-                    ffassign = group[0]
-                    numdsp_stagewise[ffassign.point[1]] += 1
+            # We assume that all assignments in a group have the same
+            # y-index as they should be in the same stage
+            bounds = dsp_repl.groups.bounds()
+            first = bounds[:-1][np.diff(bounds) > 0]
+            numdsp_stagewise = np.bincount(
+                dsp_repl.groups.y[first], minlength=network.get_depth()
+            ).tolist()
 
         for y in range(network.pmatrix.shape[0]):
             self.__make_stage(
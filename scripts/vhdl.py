@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 
 from pathlib import Path
-import regex
+import os
+import pickle
+import tempfile
 
 
 class VHDLEntity:
@@ -128,6 +130,9 @@ def parseVHDLEntity(path=Path()):
 
     Returns Entity object or None, entity couldn't be parsed.
     """
+    # regex is imported on demand, since parsed files are usually cached.
+    import regex
+
     content = ""
     # Read vhdl file and remove comments.
     with open(str(path), "r") as fd:
@@ -182,6 +187,8 @@ def parseVHDLTemplate(path=Path()):
 
     Returns a template object or None if template couldn't be parsed.
     """
+    import regex
+
     content = ""
     # Read lines of file and remove comments.
     with open(str(path), "r") as fd:
@@ -199,6 +206,69 @@ def parseVHDLTemplate(path=Path()):
     return None
 
 
+class ParseCache:
+    """On-disk cache of parsed VHDL files.
+    Results of a parser are stored per path together with modification time
+    and size of the file. Files are only parsed again if one of them changed.
+    """
+
+    # Increment when the parsed objects change in an incompatible way.
+    VERSION = 1
+
+    def __init__(self, cache_file=Path("build/.cache/vhdl.pickle")):
+        self.cache_file = Path(cache_file)
+        self.entries = dict()
+        self.modified = False
+        try:
+            with open(self.cache_file, "rb") as fd:
+                version, entries = pickle.load(fd)
+            if version == self.VERSION:
+                self.entries = entries
+        except (
+            OSError,
+            EOFError,
+            ValueError,
+            TypeError,
+            AttributeError,
+            ImportError,
+            IndexError,
+            pickle.PickleError,
+        ):
+            # Missing or unreadable cache, or one pickling classes which were
+            # renamed or moved since, start empty.
+            pass
+
+    def parse(self, path: Path, parser):
+        """Returns parser(path), reusing the cached result if the file is
+        unchanged."""
+        stat = path.stat()
+        key = (parser.__name__, str(path))
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        entry = self.entries.get(key)
+        if entry and entry[0] == stamp:
+            return entry[1]
+        result = parser(path)
+        self.entries[key] = (stamp, result)
+        self.modified = True
+        return result
+
+    def save(self):
+        """Writes the cache if anything was parsed. Entries of removed files
+        are dropped. The file is replaced atomically, so concurrent runs
+        never read a partially written cache."""
+        if not self.modified:
+            return
+        self.entries = {
+            key: entry for key, entry in self.entries.items() if Path(key[1]).exists()
+        }
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_file.parent)
+        with os.fdopen(fd, "wb") as tmp:
+            pickle.dump((self.VERSION, self.entries), tmp)
+        os.replace(tmp_path, self.cache_file)
+        self.modified = False
+
+
 cond = __name__ == "__main__"
 if cond:
     print(parseVHDLTemplate("../templates/Network.vhd").tokens)